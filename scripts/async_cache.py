@@ -0,0 +1,37 @@
+"""Per-run async memoization that shares one in-flight load per key (failures are not cached)."""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class AsyncCache:
+    def __init__(self, loader: Callable[[Any], Awaitable[Any]]):
+        self._loader = loader
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: Hashable) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._loader(key))
+            self._tasks[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget_failure(key, done))
+        else:
+            # Either already resolved or joining an in-flight load (single-flight)
+            self.hits += 1
+        # shield: a cancelled caller must not cancel the load shared with other callers
+        return await asyncio.shield(task)
+
+    def _forget_failure(self, key: Hashable, task: asyncio.Future):
+        if task.cancelled() or task.exception() is not None:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self) -> str:
+        return f"{self.hits} hits / {self.misses} misses ({self.hit_rate:.1%} hit rate)"
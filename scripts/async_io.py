@@ -0,0 +1,94 @@
+"""Shared async I/O layer: runs the blocking supabase/stripe calls on a bounded thread pool."""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Iterable, Iterator, List, Optional, TypeVar
+
+import instrumentation
+
+# Maximum number of blocking calls running at the same time
+IO_CONCURRENCY = int(os.getenv('IO_CONCURRENCY', '16'))
+
+T = TypeVar('T')
+
+_max_workers = IO_CONCURRENCY
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def configure(max_workers: int):
+    """Change the pool size. Must be called before the first `run_io`."""
+    global _max_workers
+    if _executor is not None:
+        raise RuntimeError("async_io is already running; call configure() before any I/O")
+    _max_workers = max(1, max_workers)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix='io')
+    return _executor
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(_max_workers)
+    return _semaphore
+
+
+async def run_io(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking call in the I/O pool, waiting for a free slot first."""
+    async with _get_semaphore():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), partial(fn, *args, **kwargs))
+
+
+async def execute(query: Any) -> Any:
+    """Execute a supabase/postgrest query builder without blocking the event loop."""
+    if instrumentation.enabled:
+        return await run_io(instrumentation.observe, 'supabase', instrumentation.supabase_endpoint(query), query.execute)
+    return await run_io(query.execute)
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Consecutive lists of at most `size` items; generators are consumed lazily."""
+    chunk: List[T] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def write_with_row_fallback(write: Callable[[List[T]], Awaitable[Any]], rows: List[T],
+                                  on_failure: Callable[[T, Exception], None],
+                                  on_retry: Optional[Callable[[List[T], Exception], None]] = None) -> List[T]:
+    """Write `rows` in one call, retrying them one by one if it fails; returns the rows written."""
+    try:
+        await write(rows)
+        return rows
+    except Exception as e:
+        if len(rows) == 1:
+            on_failure(rows[0], e)
+            return []
+        if on_retry:
+            on_retry(rows, e)
+
+    written: List[T] = []
+    for row in rows:
+        written.extend(await write_with_row_fallback(write, [row], on_failure))
+    return written
+
+
+def shutdown():
+    """Release the pool threads (optional, they are daemon-like at interpreter exit)."""
+    global _executor, _semaphore
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+    _executor = None
+    _semaphore = None
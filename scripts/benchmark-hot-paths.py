@@ -0,0 +1,292 @@
+"""Micro-benchmarks for the CPU-bound hot paths of the migration scripts.
+
+    python benchmark-hot-paths.py --compare baseline.json --tolerance 0.15
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
+
+import token_codec
+from token_codec import decode_payload, decode_payloads
+from token_minting import CheckoutTokenMinter, slim_service
+
+try:
+    from credentials import CredentialsDecryptor, CredentialsEncryptor
+except ImportError:  # cryptography is only needed for the credentials cases
+    CredentialsDecryptor = CredentialsEncryptor = None
+
+BENCH_KEY = 'ab' * 32
+BENCH_SECRET = 'benchmark-jwt-secret'
+# Calls per timed repeat; the best repeat is reported (least disturbed by other load)
+DEFAULT_NUMBER = 5000
+DEFAULT_REPEAT = 5
+ALLOCATION_CALLS = 200
+
+
+def sample_service() -> Dict[str, Any]:
+    """A services row with the text fields filled the way real catalog entries are."""
+    return {
+        'id': 48213,
+        'created_at': '2025-01-14T10:22:31.123456+00:00',
+        'name': 'Monthly social media management - Premium',
+        'description': 'Full management of up to five social networks, ' * 12,
+        'price': 1490.0,
+        'currency': 'usd',
+        'price_id': 'price_1QhZ2LKxV7e9uQ2b3c4d5e6f',
+        'propietary_organization_id': str(uuid.UUID(int=1)),
+        'service_image': 'https://cdn.example.com/storage/v1/object/public/services/' + 'a' * 64 + '.png',
+        'status': 'active',
+        'recurring_subscription': True,
+        'recurrence': 'monthly',
+        'number_of_clients': 0,
+        'credit_based': False,
+        'credits': 0,
+        'purchase_limit': 0,
+        'allowed_days': 0,
+        'time_based': False,
+        'hours': 0,
+        'test_period': False,
+        'test_period_duration': 0,
+        'test_period_duration_unit_of_measurement': 'days',
+        'test_period_price': 0,
+        'max_number_of_simultaneous_orders': 0,
+        'max_number_of_monthly_orders': 0,
+        'visibility': 'public',
+        'checkout_url': None,
+        'deleted_on': None,
+        'updated_at': '2025-03-02T08:00:00+00:00',
+    }
+
+
+def token_payload(service: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'account_id': 'acct_1PqRsTuVwXyZ0123',
+        'price_id': '',
+        'service': service,
+        'expires_at': '2025-06-01T12:00:00',
+        'organization_id': str(uuid.UUID(int=2)),
+        'payment_methods': [],
+        'primary_owner_id': service['propietary_organization_id'],
+    }
+
+
+def sample_credentials() -> Dict[str, Any]:
+    return {
+        'treli_user': 'billing@agency-example.com',
+        'treli_password': 'x' * 32,
+        'webhook_url': 'https://app.example.com/api/v1/webhook/treli/' + str(uuid.UUID(int=3)),
+    }
+
+
+# Each case is set up once per process: setup() -> state, then op(state) is timed
+def _setup_encrypt():
+    return CredentialsEncryptor(BENCH_KEY), sample_credentials()
+
+
+def _op_encrypt(state):
+    encryptor, credentials = state
+    encryptor.encrypt(credentials)
+
+
+def _setup_decrypt():
+    return CredentialsDecryptor(BENCH_KEY), CredentialsEncryptor(BENCH_KEY).encrypt(sample_credentials())
+
+
+def _op_decrypt(state):
+    decryptor, encrypted = state
+    decryptor.decrypt(encrypted)
+
+
+def _setup_decode():
+    return CheckoutTokenMinter(BENCH_SECRET).mint(token_payload(sample_service()))
+
+
+def _op_decode(token):
+    decode_payload(token)
+
+
+def _op_decode_fields(token):
+    for _ in decode_payloads((token,), fields=['service.id']):
+        pass
+
+
+def _setup_mint():
+    return CheckoutTokenMinter(BENCH_SECRET), token_payload(slim_service(sample_service()))
+
+
+def _op_mint(state):
+    minter, payload = state
+    minter.mint(payload)
+
+
+CASES: Dict[str, Tuple[Callable[[], Any], Callable[[Any], None], bool]] = {
+    # name: (setup, op, needs cryptography)
+    'encrypt': (_setup_encrypt, _op_encrypt, True),
+    'decrypt': (_setup_decrypt, _op_decrypt, True),
+    'decode_token': (_setup_decode, _op_decode, False),
+    'decode_fields': (_setup_decode, _op_decode_fields, False),
+    'mint': (_setup_mint, _op_mint, False),
+}
+
+
+def time_case(name: str, number: int) -> float:
+    """Run `number` calls of a case and return the elapsed seconds (also used in workers)."""
+    setup, op, _ = CASES[name]
+    state = setup()
+    start = time.perf_counter()
+    for _ in range(number):
+        op(state)
+    return time.perf_counter() - start
+
+
+def single_core(name: str, number: int, repeat: int) -> Dict[str, float]:
+    timings = [time_case(name, number) for _ in range(repeat)]
+    best = min(timings)
+    return {
+        'ops_per_sec': number / best,
+        'us_per_op': best / number * 1e6,
+        'stdev_pct': statistics.pstdev(timings) / statistics.mean(timings) * 100 if repeat > 1 else 0.0,
+    }
+
+
+def pool_scaling(name: str, number: int, worker_counts: List[int]) -> Dict[int, float]:
+    """Aggregate ops/s with `workers` processes each running `number` calls."""
+    results = {}
+    for workers in worker_counts:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Warm-up: start the processes and import everything before timing
+            list(pool.map(time_case, [name] * workers, [1] * workers))
+            start = time.perf_counter()
+            list(pool.map(time_case, [name] * workers, [number] * workers))
+            elapsed = time.perf_counter() - start
+        results[workers] = number * workers / elapsed
+    return results
+
+
+def allocations(name: str, calls: int = ALLOCATION_CALLS) -> Dict[str, float]:
+    """Peak transient bytes and allocated blocks per call, measured with tracemalloc."""
+    setup, op, _ = CASES[name]
+    state = setup()
+    op(state)  # let caches settle outside of the measurement
+    tracemalloc.start()
+    try:
+        before_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        tracemalloc.reset_peak()
+        base_current, _ = tracemalloc.get_traced_memory()
+        peak = 0
+        for _ in range(calls):
+            op(state)
+            _, call_peak = tracemalloc.get_traced_memory()
+            peak = max(peak, call_peak - base_current)
+            tracemalloc.reset_peak()
+        after_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    finally:
+        tracemalloc.stop()
+    return {
+        'peak_bytes_per_call': peak,
+        'retained_blocks_per_call': max(0, after_blocks - before_blocks) / calls,
+    }
+
+
+def default_worker_counts() -> List[int]:
+    cpus = os.cpu_count() or 1
+    counts, workers = [], 1
+    while workers < cpus:
+        counts.append(workers)
+        workers *= 2
+    counts.append(cpus)
+    return counts
+
+
+def run(args) -> Dict[str, Any]:
+    results: Dict[str, Any] = {
+        'python': sys.version.split()[0],
+        'json_backend': token_codec.JSON_BACKEND,
+        'cpus': os.cpu_count(),
+        'cases': {},
+    }
+    for name in args.cases:
+        _, _, needs_crypto = CASES[name]
+        if needs_crypto and CredentialsEncryptor is None:
+            print(f"Skipping {name}: the cryptography package is not installed")
+            continue
+        case = single_core(name, args.number, args.repeat)
+        if not args.no_pool:
+            case['pool_ops_per_sec'] = pool_scaling(name, args.number, args.workers)
+        case.update(allocations(name))
+        results['cases'][name] = case
+    return results
+
+
+def print_report(results: Dict[str, Any]):
+    print(f"\nPython {results['python']} | JSON backend: {results['json_backend']} | CPUs: {results['cpus']}")
+    print(f"\n{'case':<15} {'ops/s (1 core)':>15} {'us/op':>9} {'stdev':>7} {'peak B/call':>12} {'blocks kept':>12}")
+    for name, case in results['cases'].items():
+        print(f"{name:<15} {case['ops_per_sec']:>15,.0f} {case['us_per_op']:>9.2f} {case['stdev_pct']:>6.1f}% "
+              f"{case['peak_bytes_per_call']:>12,.0f} {case['retained_blocks_per_call']:>12.2f}")
+
+    scaled = [(name, case['pool_ops_per_sec']) for name, case in results['cases'].items() if 'pool_ops_per_sec' in case]
+    if scaled:
+        worker_counts = list(scaled[0][1])
+        print(f"\n{'case':<15} " + " ".join(f"{f'{w} proc':>12}" for w in worker_counts) + f" {'efficiency':>11}")
+        for name, by_workers in scaled:
+            best = max(worker_counts)
+            efficiency = by_workers[best] / (by_workers[worker_counts[0]] * best / worker_counts[0])
+            print(f"{name:<15} " + " ".join(f"{by_workers[w]:>12,.0f}" for w in worker_counts) + f" {efficiency:>10.0%}")
+
+
+def compare(results: Dict[str, Any], baseline_path: str, tolerance: float) -> List[str]:
+    """Return the cases whose single-core throughput dropped more than `tolerance`."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    for name, case in results['cases'].items():
+        previous: Optional[Dict[str, Any]] = baseline.get('cases', {}).get(name)
+        if not previous:
+            continue
+        change = case['ops_per_sec'] / previous['ops_per_sec'] - 1
+        flag = ''
+        if change < -tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"  {name:<15} {previous['ops_per_sec']:>12,.0f} -> {case['ops_per_sec']:>12,.0f} ops/s ({change:+.1%}){flag}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the crypto and token hot paths")
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES), help="Cases to run")
+    parser.add_argument('--number', type=int, default=DEFAULT_NUMBER, help="Calls per timed repeat")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Timed repeats (best one is kept)")
+    parser.add_argument('--workers', type=int, nargs='+', default=default_worker_counts(),
+                        help="Process counts for the scaling table")
+    parser.add_argument('--no-pool', action='store_true', help="Skip the process pool scaling table")
+    parser.add_argument('--json', help="Save the results to this JSON file")
+    parser.add_argument('--compare', help="Previous --json results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="Allowed single-core throughput drop before flagging a regression")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = run(args)
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.json}")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
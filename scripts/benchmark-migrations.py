@@ -0,0 +1,124 @@
+"""End-to-end benchmark of the migration scripts against the local fake backends.
+
+    python benchmark-migrations.py --agencies 50 --latency-ms 25 --rate-limit-ratio 0.02
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from fake_backends import FakeBackends, build_dataset
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# name -> command line (relative to scripts/)
+SCRIPTS = {
+    'migrate-stripe-subscriptions': ['migrate-stripe-subscriptions.py'],
+    # Incremental run over the last day of events (the fake dataset has about 10% recent churn)
+    'migrate-stripe-subscriptions-since': ['migrate-stripe-subscriptions.py', '--since', str(int(time.time()) - 86400)],
+    'update-services-checkout': ['update-services-checkout.py'],
+    'update-token-services': ['update-token-services.py'],
+    'update-token-services-set-based': ['update-token-services.py', '--set-based'],
+}
+DEFAULT_SCRIPTS = ['migrate-stripe-subscriptions', 'update-services-checkout', 'update-token-services-set-based']
+SCRIPT_TIMEOUT_SECONDS = 1800
+
+
+def run_script(name: str, backend: FakeBackends, dataset: Dict[str, Any], work_dir: str,
+               extra_args: List[str]) -> Dict[str, Any]:
+    backend.load(dataset)
+    script_dir = os.path.join(work_dir, name)
+    os.makedirs(script_dir, exist_ok=True)
+    log_path = os.path.join(script_dir, 'output.log')
+    command = [sys.executable, os.path.join(SCRIPTS_DIR, SCRIPTS[name][0]), *SCRIPTS[name][1:], *extra_args]
+    env = {**os.environ, **backend.client_env(), 'NEXT_PUBLIC_SITE_URL': 'http://localhost:3000/'}
+
+    start = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        try:
+            exit_code = subprocess.run(command, cwd=script_dir, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                       timeout=SCRIPT_TIMEOUT_SECONDS).returncode
+        except subprocess.TimeoutExpired:
+            exit_code = 'timeout'
+    wall = time.perf_counter() - start
+
+    counts = backend.request_counts()
+    supabase_requests = sum(count for endpoint, count in counts.items() if endpoint.startswith('supabase'))
+    stripe_requests = sum(count for endpoint, count in counts.items() if endpoint.startswith('stripe'))
+    return {
+        'script': name,
+        'exit_code': exit_code,
+        'wall_seconds': wall,
+        'supabase_requests': supabase_requests,
+        'stripe_requests': stripe_requests,
+        'rate_limited': backend.rate_limited,
+        'errors': sum(backend.errors.values()),
+        'requests_per_second': (supabase_requests + stripe_requests) / wall if wall else 0.0,
+        'endpoints': counts,
+        'log': log_path,
+    }
+
+
+def print_report(results: List[Dict[str, Any]], show_endpoints: bool):
+    print(f"\n{'script':<34} {'exit':>5} {'wall s':>8} {'supabase':>9} {'stripe':>7} {'429':>5} "
+          f"{'errors':>7} {'req/s':>8}")
+    for result in results:
+        print(f"{result['script']:<34} {str(result['exit_code']):>5} {result['wall_seconds']:>8.2f} "
+              f"{result['supabase_requests']:>9} {result['stripe_requests']:>7} {result['rate_limited']:>5} "
+              f"{result['errors']:>7} {result['requests_per_second']:>8.1f}")
+        if show_endpoints:
+            for endpoint, count in sorted(result['endpoints'].items(), key=lambda item: -item[1]):
+                print(f"    {endpoint:<45} {count:>7}")
+    failed = [result for result in results if result['exit_code'] != 0]
+    for result in failed:
+        print(f"\n{result['script']} exited with {result['exit_code']}, see {result['log']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the migration scripts end to end against fake backends")
+    parser.add_argument('--scripts', nargs='+', choices=list(SCRIPTS), default=DEFAULT_SCRIPTS, help="Scripts to run")
+    parser.add_argument('--agencies', type=int, default=10)
+    parser.add_argument('--clients', type=int, default=50, help="Clients per agency")
+    parser.add_argument('--subscriptions', type=int, default=60, help="Stripe subscriptions per agency")
+    parser.add_argument('--services', type=int, default=20, help="Services per agency")
+    parser.add_argument('--tokens', type=int, default=100, help="Legacy checkout tokens per agency")
+    parser.add_argument('--latency-ms', type=float, default=10.0, help="Delay added to every request")
+    parser.add_argument('--stripe-latency-ms', type=float, help="Delay for Stripe requests (default: --latency-ms)")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="Share of Stripe requests answered with 429")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--work-dir', help="Where scripts run and write their files (default: a temp dir)")
+    parser.add_argument('--endpoints', action='store_true', help="Also list requests per endpoint")
+    parser.add_argument('--json', help="Save the results to this JSON file")
+    parser.add_argument('script_args', nargs=argparse.REMAINDER,
+                        help="Arguments after `--` are passed to every script")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    extra_args = args.script_args[1:] if args.script_args[:1] == ['--'] else args.script_args
+    dataset = build_dataset(args.agencies, args.clients, args.subscriptions, args.services, args.tokens, args.seed)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='migrations-benchmark-')
+    print(f"Dataset: {args.agencies} agencies, {sum(len(rows) for rows in dataset['tables'].values())} rows, "
+          f"{sum(len(subs) for subs in dataset['stripe_subscriptions'].values())} Stripe subscriptions")
+    print(f"Working directory: {work_dir}")
+
+    backend = FakeBackends(dataset, latency_ms=args.latency_ms, stripe_latency_ms=args.stripe_latency_ms,
+                           rate_limit_ratio=args.rate_limit_ratio, seed=args.seed).start()
+    try:
+        results = []
+        for name in args.scripts:
+            print(f"Running {name}...")
+            results.append(run_script(name, backend, dataset, work_dir, extra_args))
+    finally:
+        backend.stop()
+
+    print_report(results, args.endpoints)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.json}")
+    sys.exit(0 if all(result['exit_code'] == 0 for result in results) else 1)
@@ -0,0 +1,76 @@
+"""Append-only JSON-lines checkpoint journal, so a re-run with `resume=True` skips the work already done."""
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Set
+
+
+class CheckpointJournal:
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.completed: Dict[str, Set[str]] = {}
+        self.loaded_records = 0
+
+        if resume and os.path.exists(path):
+            self._load()
+            mode = 'a'
+        else:
+            mode = 'w'
+
+        self._file = open(path, mode, encoding='utf-8')
+        if mode == 'a' and self._ends_mid_line():
+            # Terminate a truncated last line so the next record starts on its own line
+            self._file.write('\n')
+
+    def _ends_mid_line(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b'\n'
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line may be truncated if the previous run was killed mid-write
+                    continue
+                self.completed.setdefault(record['type'], set()).add(record['id'])
+                self.loaded_records += 1
+
+    def is_done(self, kind: str, item_id: str) -> bool:
+        return item_id in self.completed.get(kind, ())
+
+    def count(self, kind: str) -> int:
+        return len(self.completed.get(kind, ()))
+
+    def mark_done(self, kind: str, item_id: str, **extra):
+        self.mark_many_done(kind, [item_id], **extra)
+
+    def mark_many_done(self, kind: str, item_ids: Iterable[str], **extra):
+        """Record several items with a single flush (used after each write batch)."""
+        done = self.completed.setdefault(kind, set())
+        now = datetime.now().isoformat()
+        lines = []
+        for item_id in item_ids:
+            done.add(item_id)
+            lines.append(json.dumps({'type': kind, 'id': item_id, **extra, 'at': now}, ensure_ascii=False))
+        if lines:
+            self._file.write('\n'.join(lines) + '\n')
+            self._file.flush()
+
+    def sync(self):
+        """Force the journal to disk (call at coarse milestones, e.g. after each agency)."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
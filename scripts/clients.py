@@ -0,0 +1,35 @@
+"""Client factories shared by the scripts, overridable through SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY,
+STRIPE_SECRET_KEY, STRIPE_API_BASE and DATABASE_URL.
+"""
+import os
+from typing import Any, Callable, Optional
+
+
+def _create_supabase(url: str, key: str) -> Any:
+    from supabase import create_client
+    return create_client(url, key)
+
+
+_supabase_factory: Callable[[str, str], Any] = _create_supabase
+
+
+def set_supabase_factory(factory: Optional[Callable[[str, str], Any]]):
+    """Use `factory(url, key)` for the next clients (None restores the real one)."""
+    global _supabase_factory
+    _supabase_factory = factory or _create_supabase
+
+
+def supabase_client(url: str, key: str) -> Any:
+    return _supabase_factory(os.getenv('SUPABASE_URL') or url, os.getenv('SUPABASE_SERVICE_ROLE_KEY') or key)
+
+
+def configure_stripe(api_key: str) -> Any:
+    """Set the module-level Stripe key (and API base, if overridden) and return `stripe`."""
+    import stripe
+    stripe.api_key = os.getenv('STRIPE_SECRET_KEY') or api_key
+    # stripe_throttle.call_stripe owns the retries; library retries would hide 429s from its limiter
+    stripe.max_network_retries = 0
+    api_base = os.getenv('STRIPE_API_BASE')
+    if api_base:
+        stripe.api_base = api_base.rstrip('/')
+    return stripe
@@ -1,91 +1,242 @@
-import stripe
+import argparse
+import csv
+import hashlib
 import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-GREEN = "\033[92m"  
-RED = "\033[91m"    
+import stripe_throttle
+from clients import configure_stripe
+from sql_emitter import ROWS_PER_STATEMENT, SqlEmitter
+from stripe_throttle import call_stripe
+
+GREEN = "\033[92m"
+RED = "\033[91m"
+YELLOW = "\033[93m"
 RESET = "\033[0m"
 
 # Config
-# stripe.api_key = "your_api_key_stripe_test!"  
-stripe.api_key = "your_api_key_stripe_test!"  
-# emails_without_customer = {"example@example.co": None, "example+a111@example.com": None}  
-emails_without_customer = {}  
-# price_id = "your_price_id_test"  
-price_id = "your_price_id_test!"  
+# stripe.api_key = "your_api_key_stripe_test!"
+STRIPE_API_KEY = "your_api_key_stripe_test!"
+# emails_without_customer = {"example@example.co": None, "example+a111@example.com": None}
+emails_without_customer = {}
+# price_id = "your_price_id_test"
+price_id = "your_price_id_test!"
 
-# List to save with SQL code
-subscriptions_sql = []
+SQL_FILE = "subscriptions.sql"
+SUBSCRIPTION_COLUMNS = [
+    'account_id', 'active', 'billing_customer_id', 'billing_provider',
+    'cancel_at_period_end', 'created_at', 'currency', 'id',
+    'period_ends_at', 'period_starts_at', 'propietary_organization_id',
+    'status', 'trial_ends_at', 'trial_starts_at', 'updated_at'
+]
+# Emails provisioned at the same time (each one is a customer + a subscription call)
+PROVISION_WORKERS = int(os.getenv('PROVISION_WORKERS', '8'))
+STRIPE_PAGE_SIZE = 100
+# Subscriptions in these states are reused instead of creating a new one
+REUSABLE_STATUSES = {'active', 'trialing', 'past_due', 'incomplete'}
 
-# Function to create clients
-def create_customers_y_subscriptions(emails):
-    for email, proprietary_org_id in emails.items():
-        # Create client in Stripe
+stripe = configure_stripe(STRIPE_API_KEY)
+
+_stats_lock = threading.Lock()
+stats = {
+    'customers_created': 0,
+    'customers_reused': 0,
+    'subscriptions_created': 0,
+    'subscriptions_reused': 0,
+    'failed': 0
+}
+
+
+def count(key):
+    with _stats_lock:
+        stats[key] += 1
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def idempotency_key(kind, *parts):
+    """Stable key per email (and price): a retried or re-run request never creates a duplicate"""
+    digest = hashlib.sha256("|".join(parts).encode('utf-8')).hexdigest()
+    return f"provision-{kind}-{digest[:48]}"
+
+
+def read_emails(path):
+    """Stream (email, propietary_organization_id) pairs from a CSV (with header) or JSONL file"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        rows = (json.loads(line) for line in f if line.strip()) if path.endswith('.jsonl') else csv.DictReader(f)
+        for row in rows:
+            if row.get('email'):
+                yield row['email'], row.get('propietary_organization_id') or None
+
+
+def list_existing_customers():
+    """Index every existing customer by email, with its subscriptions, in pages of 100"""
+    customers = {}
+    starting_after = None
+    while True:
+        page = call_stripe(
+            stripe.Customer.list,
+            limit=STRIPE_PAGE_SIZE,
+            expand=['data.subscriptions'],
+            **({'starting_after': starting_after} if starting_after else {})
+        )
+        for customer in page.data:
+            email = getattr(customer, 'email', None)
+            if email:
+                # Keep the oldest customer when an email is duplicated (the list is newest first)
+                customers[normalize_email(email)] = customer
+        if not page.has_more or not page.data:
+            return customers
+        starting_after = page.data[-1].id
+
+
+def iter_customer_subscriptions(customer):
+    """The subscriptions embedded by the expand (first 10 only), then the remaining pages"""
+    page = getattr(customer, 'subscriptions', None)
+    if page is None:
+        return
+    yield from page.data
+    while page.has_more and page.data:
+        page = call_stripe(stripe.Subscription.list, customer=customer.id, limit=STRIPE_PAGE_SIZE,
+                           starting_after=page.data[-1].id)
+        yield from page.data
+
+
+def find_reusable_subscription(customer):
+    for subscription in iter_customer_subscriptions(customer):
+        if subscription['status'] in REUSABLE_STATUSES and any(
+            item['price']['id'] == price_id for item in subscription['items']['data']
+        ):
+            return subscription
+    return None
+
+
+def period_bounds(subscription):
+    """Newer API versions report the billing period on the subscription items"""
+    source = subscription if getattr(subscription, 'current_period_start', None) else subscription['items']['data'][0]
+    return source['current_period_start'], source['current_period_end']
+
+
+def provision(email, proprietary_org_id, existing_customer):
+    """Create (or reuse) the customer and the starter subscription of one email"""
+    key_email = normalize_email(email)
+
+    if existing_customer is not None:
+        customer = existing_customer
+        count('customers_reused')
+    else:
         print(f"Creating customer for email: {email}")
-        customer = stripe.Customer.create(email=email)
-        customer_id = customer.id
-        
-        # Create starter subscription
+        customer = call_stripe(stripe.Customer.create, email=email,
+                               idempotency_key=idempotency_key('customer', key_email))
+        count('customers_created')
+    customer_id = customer.id
+
+    subscription = find_reusable_subscription(customer) if existing_customer is not None else None
+    if subscription is not None:
+        count('subscriptions_reused')
+    else:
         print(f"Creating subscription for customer: {customer_id}")
-        subscription = stripe.Subscription.create(
+        subscription = call_stripe(
+            stripe.Subscription.create,
             customer=customer_id,
             items=[{"price": price_id}],
+            idempotency_key=idempotency_key('subscription', key_email, price_id),
         )
-        
-        # Capture the necessary data for the SQL insertion
-        subscription_data = {
-            "account_id": None,  
-            "active": subscription['status'] == 'active',
-            "billing_customer_id": customer_id,
-            "billing_provider": "stripe",  
-            "cancel_at_period_end": False,
-            "created_at": datetime.fromtimestamp(subscription['created']).isoformat(),
-            "currency": "usd",
-            "id": subscription.id,
-            "period_ends_at": datetime.fromtimestamp(subscription['current_period_end']).isoformat(),
-            "period_starts_at": datetime.fromtimestamp(subscription['current_period_start']).isoformat(),
-            "propietary_organization_id": proprietary_org_id, 
-            "status": "active",
-            "trial_ends_at": None,  
-            "trial_starts_at": None, 
-            "updated_at": None,
-        }
-        
-        # Generate the insertion line SQL
-        # Generar la línea de inserción SQL
-        sql_insert = f"""
-        INSERT INTO subscriptions (
-            account_id, active, billing_customer_id, billing_provider,
-            cancel_at_period_end, created_at, currency, id,
-            period_ends_at, period_starts_at, propietary_organization_id,
-            status, trial_ends_at, trial_starts_at, updated_at
-        ) VALUES (
-            {subscription_data['account_id'] if subscription_data['account_id'] is not None else 'NULL'}, 
-            {subscription_data['active']}, 
-            '{subscription_data['billing_customer_id']}',
-            '{subscription_data['billing_provider']}', 
-            {subscription_data['cancel_at_period_end']}, 
-            '{subscription_data['created_at']}', 
-            '{subscription_data['currency']}', 
-            '{subscription_data['id']}',
-            '{subscription_data['period_ends_at']}', 
-            '{subscription_data['period_starts_at']}', 
-            '{subscription_data['propietary_organization_id'] if subscription_data['propietary_organization_id'] is not None else 'NULL'}', 
-            '{subscription_data['status']}', 
-            {subscription_data['trial_ends_at'] if subscription_data['trial_ends_at'] is not None else 'NULL'}, 
-            {subscription_data['trial_starts_at'] if subscription_data['trial_starts_at'] is not None else 'NULL'}, 
-            {subscription_data['updated_at'] if subscription_data['updated_at'] is not None else 'NULL'}
-        );
-        """
-
-        subscriptions_sql.append(sql_insert)
-
-# Call the function
-create_customers_y_subscriptions(emails_without_customer)
-
-# Save the SQL file
-with open("subscriptions.sql", "w") as file:
-    for line in subscriptions_sql:
-        file.write(line + "\n")
-
-print(f"{GREEN}Process completed. SQL file generated: subscriptions.sql{RESET}")
\ No newline at end of file
+        count('subscriptions_created')
+
+    period_start, period_end = period_bounds(subscription)
+    # Capture the necessary data for the SQL insertion
+    return {
+        "account_id": None,
+        "active": subscription['status'] == 'active',
+        "billing_customer_id": customer_id,
+        "billing_provider": "stripe",
+        "cancel_at_period_end": False,
+        "created_at": datetime.fromtimestamp(subscription['created']).isoformat(),
+        "currency": "usd",
+        "id": subscription.id,
+        "period_ends_at": datetime.fromtimestamp(period_end).isoformat(),
+        "period_starts_at": datetime.fromtimestamp(period_start).isoformat(),
+        "propietary_organization_id": proprietary_org_id,
+        "status": "active",
+        "trial_ends_at": None,
+        "trial_starts_at": None,
+        "updated_at": None,
+    }
+
+
+# Function to create clients
+def create_customers_y_subscriptions(emails, sql_file=SQL_FILE, workers=PROVISION_WORKERS,
+                                     sql_format='values', rows_per_statement=ROWS_PER_STATEMENT):
+    """Provision every (email, propietary_organization_id) pair on a bounded thread pool, reusing existing customers."""
+    existing = list_existing_customers()
+    print(f"Found {len(existing)} existing customers")
+
+    failures = []
+    seen = set()
+    with open(sql_file, "w", encoding="utf-8") as file, \
+            SqlEmitter(file, 'subscriptions', SUBSCRIPTION_COLUMNS, fmt=sql_format,
+                       rows_per_statement=rows_per_statement, on_conflict='id') as emitter, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = deque()
+
+        def drain(limit):
+            while len(pending) > limit:
+                email, future = pending.popleft()
+                try:
+                    emitter.add(future.result())
+                except Exception as e:
+                    count('failed')
+                    failures.append({'email': email, 'error': str(e)})
+                    print(f"{RED}Error provisioning {email}: {str(e)}{RESET}")
+
+        for email, proprietary_org_id in emails:
+            key_email = normalize_email(email)
+            if key_email in seen:
+                continue
+            seen.add(key_email)
+            pending.append((email, pool.submit(provision, email, proprietary_org_id, existing.get(key_email))))
+            drain(max(1, workers) * 2)
+        drain(0)
+
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create Stripe customers and starter subscriptions in bulk")
+    parser.add_argument('--input', help="CSV or JSONL with email and propietary_organization_id (default: emails_without_customer)")
+    parser.add_argument('--output', default=SQL_FILE, help=f"SQL file to write (default: {SQL_FILE})")
+    parser.add_argument('--sql-format', choices=['values', 'copy'], default='values',
+                        help="Multi-row INSERT statements, or a COPY block for psql -f (faster to load)")
+    parser.add_argument('--rows-per-statement', type=int, default=ROWS_PER_STATEMENT,
+                        help="Rows per INSERT statement (values format)")
+    parser.add_argument('--workers', type=int, default=PROVISION_WORKERS, help="Emails provisioned concurrently")
+    parser.add_argument('--stripe-rps', type=float, default=stripe_throttle.STRIPE_MAX_RPS,
+                        help="Stripe requests per second across all workers")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    stripe_throttle.configure(max_rps=args.stripe_rps)
+
+    # Call the function
+    emails = read_emails(args.input) if args.input else emails_without_customer.items()
+    failures = create_customers_y_subscriptions(emails, args.output, args.workers,
+                                                args.sql_format, args.rows_per_statement)
+
+    print(f"Customers created: {stats['customers_created']}, reused: {stats['customers_reused']}")
+    print(f"Subscriptions created: {stats['subscriptions_created']}, reused: {stats['subscriptions_reused']}")
+    if failures:
+        failed_filename = f"failed_provisioning_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        with open(failed_filename, 'w', encoding='utf-8') as f:
+            json.dump(failures, f, indent=2, ensure_ascii=False)
+        print(f"{YELLOW}{len(failures)} emails failed, see {failed_filename} (re-running is safe){RESET}")
+
+    print(f"{GREEN}Process completed. SQL file generated: {args.output}{RESET}")
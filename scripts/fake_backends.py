@@ -0,0 +1,527 @@
+"""Local stand-ins for Supabase (PostgREST) and Stripe over a generated dataset, for offline runs and benchmarks.
+
+Run `python fake_backends.py` to keep both servers up for manual runs.
+"""
+import argparse
+import base64
+import fnmatch
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from token_minting import CheckoutTokenMinter
+
+# PostgREST embeds: (table, embedded table) -> (local column, remote column)
+EMBEDS = {
+    ('billing_accounts', 'accounts'): ('account_id', 'id'),
+    ('organization_subdomains', 'subdomains'): ('subdomain_id', 'id'),
+}
+# Tables whose primary key is generated as a uuid when an insert omits it
+UUID_KEY_TABLES = {'tokens', 'client_subscriptions', 'clients', 'accounts', 'organizations'}
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+# Dummy JWT-shaped key: supabase-py validates the key format, not its signature
+FAKE_SERVICE_ROLE_KEY = '.'.join(
+    base64.urlsafe_b64encode(part.encode()).decode().rstrip('=')
+    for part in ('{"alg":"HS256","typ":"JWT"}', '{"role":"service_role"}', 'fake-signature')
+)
+FAKE_STRIPE_KEY = 'sk_test_fake'
+# Tokens created before the cut-off of update-token-services
+LEGACY_TOKEN_CREATED_AT = '2025-01-15T10:00:00+00:00'
+SYNC_STATUSES = ['active', 'trialing', 'past_due']
+# Share of subscriptions changed in the last hours (customer.subscription.updated events)
+RECENT_CHURN_RATIO = 0.1
+
+
+def build_dataset(agencies: int = 10, clients_per_agency: int = 50, subscriptions_per_agency: int = 60,
+                  services_per_agency: int = 20, tokens_per_agency: int = 100, seed: int = 1) -> Dict[str, Any]:
+    """Generate consistent Supabase tables, Stripe subscriptions and subscription events per agency."""
+    rng = random.Random(seed)
+    # Separate generator, so the events do not change the rest of a seeded dataset
+    event_rng = random.Random(seed + 1)
+    minter = CheckoutTokenMinter('fake-jwt-secret')
+    now = int(time.time())
+    tables: Dict[str, List[Dict[str, Any]]] = {name: [] for name in (
+        'accounts', 'organizations', 'billing_accounts', 'subdomains', 'organization_subdomains',
+        'clients', 'client_subscriptions', 'services', 'tokens')}
+    subscriptions: Dict[str, List[Dict[str, Any]]] = {}
+    events: Dict[str, List[Dict[str, Any]]] = {}
+    service_id = 0
+
+    def new_id() -> str:
+        return str(uuid.UUID(int=rng.getrandbits(128)))
+
+    for a in range(agencies):
+        owner_id, organization_id, stripe_account = new_id(), new_id(), f'acct_fake{a:06d}'
+        tables['accounts'].append({'id': owner_id, 'email': f'owner{a}@agency{a}.test', 'name': f'Owner {a}',
+                                   'organization_id': organization_id})
+        tables['accounts'].append({'id': organization_id, 'email': f'billing@agency{a}.test', 'name': f'Agency {a}',
+                                   'primary_owner_user_id': owner_id, 'slug': f'agency-{a}',
+                                   'picture_url': None, 'loom_app_id': None, 'organization_id': None})
+        tables['organizations'].append({'id': organization_id, 'name': f'Agency {a}', 'owner_id': owner_id})
+        tables['billing_accounts'].append({'id': new_id(), 'account_id': owner_id, 'provider': 'stripe',
+                                           'provider_id': stripe_account, 'stripe_id': stripe_account})
+        subdomain_id = new_id()
+        tables['subdomains'].append({'id': subdomain_id, 'domain': f'agency-{a}.suuper.test'})
+        tables['organization_subdomains'].append({'id': new_id(), 'organization_id': organization_id,
+                                                  'subdomain_id': subdomain_id})
+
+        clients_by_email = {}
+        for c in range(clients_per_agency):
+            user_id, email = new_id(), f'client{c}@agency{a}.test'
+            client = {'id': new_id(), 'user_client_id': user_id, 'agency_id': organization_id,
+                      'organization_client_id': new_id()}
+            clients_by_email[email] = client
+            tables['accounts'].append({'id': user_id, 'email': email, 'name': f'Client {c}', 'organization_id': None})
+            tables['clients'].append(client)
+
+        emails = list(clients_by_email)
+        account_subscriptions = subscriptions.setdefault(stripe_account, [])
+        for s in range(subscriptions_per_agency):
+            known = emails and rng.random() < 0.8
+            email = rng.choice(emails) if known else f'unknown{s}@elsewhere.test'
+            status = rng.choice(SYNC_STATUSES + ['canceled'])
+            customer_id = f'cus_fake{a:04d}{s:06d}'
+            start = now - rng.randint(1, 25) * 86400
+            subscription = {
+                'id': f'sub_fake{a:04d}{s:06d}', 'object': 'subscription', 'status': status, 'currency': 'usd',
+                'created': start,
+                'customer': {'id': customer_id, 'object': 'customer', 'email': email},
+                'items': {'object': 'list', 'data': [{
+                    'id': f'si_fake{a:04d}{s:06d}', 'object': 'subscription_item',
+                    'current_period_start': start, 'current_period_end': start + 30 * 86400,
+                    'trial_start': start if status == 'trialing' else None,
+                    'trial_end': start + 14 * 86400 if status == 'trialing' else None,
+                }]},
+            }
+            account_subscriptions.append(subscription)
+            account_events = events.setdefault(stripe_account, [])
+            account_events.append(_subscription_event(event_rng, 'customer.subscription.created', start, subscription))
+            if event_rng.random() < RECENT_CHURN_RATIO:
+                account_events.append(_subscription_event(
+                    event_rng, 'customer.subscription.updated', now - event_rng.randint(60, 6 * 3600), subscription))
+            if known and rng.random() < 0.33:
+                tables['client_subscriptions'].append({
+                    'id': new_id(), 'client_id': clients_by_email[email]['id'], 'billing_customer_id': customer_id,
+                    'billing_provider': 'stripe', 'billing_subscription_id': subscription['id'], 'status': 'active',
+                    'active': True, 'currency': 'usd', 'created_at': LEGACY_TOKEN_CREATED_AT,
+                    'updated_at': LEGACY_TOKEN_CREATED_AT})
+
+        linked_services = []
+        for _ in range(services_per_agency):
+            service_id += 1
+            service = {'id': service_id, 'name': f'Service {service_id}', 'description': 'Monthly retainer. ' * 20,
+                       'price': 100.0 + service_id, 'currency': 'usd', 'price_id': f'price_fake{service_id:08d}',
+                       'propietary_organization_id': owner_id, 'status': 'active', 'checkout_url': None}
+            if service_id % 2 == 0:
+                token_id = f'{new_id()}suuper'
+                service['checkout_url'] = f'http://agency-{a}.suuper.test/checkout?tokenId={token_id}'
+                tables['tokens'].append(_token_row(minter, token_id, {'service': {'id': service_id}},
+                                                   datetime.now(timezone.utc).isoformat(), new_id()))
+                linked_services.append(service)
+            tables['services'].append(service)
+
+        for _ in range(tokens_per_agency if linked_services else 0):
+            service = rng.choice(linked_services)
+            tables['tokens'].append(_token_row(minter, f'{new_id()}suuper', {'service': service},
+                                               LEGACY_TOKEN_CREATED_AT, new_id()))
+
+    for account_events in events.values():
+        account_events.sort(key=lambda event: event['created'], reverse=True)
+    return {'tables': tables, 'stripe_subscriptions': subscriptions, 'stripe_events': events}
+
+
+def _subscription_event(rng: random.Random, event_type: str, created: int,
+                        subscription: Dict[str, Any]) -> Dict[str, Any]:
+    return {'id': f'evt_fake{rng.getrandbits(64):016x}', 'object': 'event', 'type': event_type, 'created': created,
+            'data': {'object': {**subscription, 'customer': subscription['customer']['id']}}}
+
+
+def _token_row(minter: CheckoutTokenMinter, id_token_provider: str, payload: Dict[str, Any],
+               created_at: str, token_id: str) -> Dict[str, Any]:
+    return {'id': token_id, 'id_token_provider': id_token_provider, 'provider': 'suuper',
+            'access_token': minter.mint(payload), 'refresh_token': '', 'created_at': created_at,
+            'updated_at': created_at, 'expires_at': created_at}
+
+
+def _text(value: Any) -> str:
+    """Render a stored value the way it appears in a PostgREST filter."""
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _compare(value: Any, operand: str) -> Optional[float]:
+    """Three-way comparison of a stored value with a filter operand (None if incomparable)."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return float(value) - float(operand)
+        except ValueError:
+            return None
+    text = str(value)
+    return (text > operand) - (text < operand)
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas that are not inside parentheses or double quotes."""
+    parts, depth, quoted, current = [], 0, False, ''
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        if char == ',' and depth == 0 and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    if current:
+        parts.append(current)
+    return [part.strip() for part in parts]
+
+
+def _matches(row: Dict[str, Any], column: str, expression: str) -> bool:
+    negate = expression.startswith('not.')
+    if negate:
+        expression = expression[4:]
+    operator, _, operand = expression.partition('.')
+    value = row.get(column)
+    if operator == 'eq':
+        result = _text(value) == operand
+    elif operator == 'neq':
+        result = _text(value) != operand
+    elif operator == 'is':
+        result = _text(value) == operand.lower()
+    elif operator == 'in':
+        options = {option.strip('"') for option in _split_top_level(operand.strip('()'))}
+        result = _text(value) in options
+    elif operator in ('gt', 'gte', 'lt', 'lte'):
+        diff = _compare(value, operand)
+        result = diff is not None and {
+            'gt': diff > 0, 'gte': diff >= 0, 'lt': diff < 0, 'lte': diff <= 0}[operator]
+    else:
+        raise ValueError(f"Unsupported filter operator: {operator}")
+    return result != negate
+
+
+class FakeBackends:
+    def __init__(self, dataset: Dict[str, Any], latency_ms: float = 0.0, stripe_latency_ms: Optional[float] = None,
+                 rate_limit_ratio: float = 0.0, seed: int = 1, host: str = '127.0.0.1'):
+        self.latency = latency_ms / 1000
+        self.stripe_latency = (latency_ms if stripe_latency_ms is None else stripe_latency_ms) / 1000
+        self.rate_limit_ratio = rate_limit_ratio
+        self.host = host
+        self.lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._servers: List[ThreadingHTTPServer] = []
+        self.load(dataset)
+
+    def load(self, dataset: Dict[str, Any]):
+        """Replace the data (e.g. a fresh copy before each benchmarked script) and the counters."""
+        with self.lock:
+            self.tables = {name: [dict(row) for row in rows] for name, rows in dataset['tables'].items()}
+            self.stripe_subscriptions = dataset['stripe_subscriptions']
+            self.stripe_events = dataset.get('stripe_events', {})
+            self.requests: Counter = Counter()
+            self.errors: Counter = Counter()
+            self.rate_limited = 0
+
+    # --- lifecycle -----------------------------------------------------------------
+
+    def start(self):
+        self.supabase_url = self._serve(_PostgrestHandler)
+        self.stripe_api_base = self._serve(_StripeHandler)
+        return self
+
+    def _serve(self, handler: type) -> str:
+        server = ThreadingHTTPServer((self.host, 0), type(handler.__name__, (handler,), {'backend': self}))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self._servers.append(server)
+        return f'http://{self.host}:{server.server_address[1]}'
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def client_env(self) -> Dict[str, str]:
+        """Environment variables that point clients.py at these servers."""
+        return {
+            'SUPABASE_URL': self.supabase_url,
+            'SUPABASE_SERVICE_ROLE_KEY': FAKE_SERVICE_ROLE_KEY,
+            'STRIPE_SECRET_KEY': FAKE_STRIPE_KEY,
+            'STRIPE_API_BASE': self.stripe_api_base,
+        }
+
+    def request_counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.requests)
+
+    def _count(self, endpoint: str, status: int):
+        with self.lock:
+            self.requests[endpoint] += 1
+            if status >= 400:
+                self.errors[endpoint] += 1
+
+    def should_rate_limit(self) -> bool:
+        if not self.rate_limit_ratio:
+            return False
+        with self.lock:
+            limited = self._rng.random() < self.rate_limit_ratio
+            self.rate_limited += limited
+            return limited
+
+    # --- PostgREST -----------------------------------------------------------------
+
+    def select(self, table: str, params: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = [row for row in self.tables.get(table, []) if self._filter(row, params)]
+            rows = [dict(row) for row in rows]
+        query = dict(params)
+        for order in reversed(query.get('order', '').split(',') if query.get('order') else []):
+            column, *modifiers = order.split('.')
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column) if row.get(column) is not None else 0),
+                      reverse='desc' in modifiers)
+        offset = int(query.get('offset', 0))
+        rows = rows[offset:offset + int(query['limit'])] if 'limit' in query else rows[offset:]
+        return [self._project(table, row, query.get('select', '*')) for row in rows]
+
+    def _filter(self, row: Dict[str, Any], params: List[Tuple[str, str]]) -> bool:
+        return all(_matches(row, column, expression) for column, expression in params if column not in RESERVED_PARAMS)
+
+    def _project(self, table: str, row: Dict[str, Any], select: str) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        for item in _split_top_level(select):
+            if item == '*':
+                result.update(row)
+            elif '(' in item:
+                embedded, columns = item[:-1].split('(', 1)
+                local, remote = EMBEDS[(table, embedded.strip())]
+                with self.lock:
+                    match = next((other for other in self.tables.get(embedded.strip(), [])
+                                  if other.get(remote) == row.get(local)), None)
+                result[embedded.strip()] = self._project(embedded.strip(), match, columns) if match else None
+            else:
+                result[item] = row.get(item)
+        return result
+
+    def write(self, table: str, rows: List[Dict[str, Any]], on_conflict: Optional[str]) -> List[Dict[str, Any]]:
+        written = []
+        with self.lock:
+            stored = self.tables.setdefault(table, [])
+            index = {row.get(on_conflict): row for row in stored} if on_conflict else {}
+            for row in rows:
+                existing = index.get(row.get(on_conflict)) if on_conflict else None
+                if existing is not None:
+                    existing.update(row)
+                    written.append(dict(existing))
+                    continue
+                new_row = dict(row)
+                if 'id' not in new_row and table in UUID_KEY_TABLES:
+                    new_row['id'] = str(uuid.uuid4())
+                new_row.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+                stored.append(new_row)
+                if on_conflict:
+                    index[new_row.get(on_conflict)] = new_row
+                written.append(dict(new_row))
+        return written
+
+    def update(self, table: str, params: List[Tuple[str, str]], values: Dict[str, Any]) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = [row for row in self.tables.get(table, []) if self._filter(row, params)]
+            for row in rows:
+                row.update(values)
+            return [dict(row) for row in rows]
+
+    # --- Stripe --------------------------------------------------------------------
+
+    def list_subscriptions(self, account: str, params: List[Tuple[str, str]]) -> Dict[str, Any]:
+        query = dict(params)
+        expand = {value for key, value in params if key.startswith('expand')}
+        status = query.get('status')
+        limit = min(int(query.get('limit', 10)), 100)
+        subscriptions = [subscription for subscription in self.stripe_subscriptions.get(account, [])
+                         if status in (None, 'all') or subscription['status'] == status]
+        if query.get('starting_after'):
+            ids = [subscription['id'] for subscription in subscriptions]
+            start = ids.index(query['starting_after']) + 1 if query['starting_after'] in ids else len(ids)
+            subscriptions = subscriptions[start:]
+        page = subscriptions[:limit]
+        data = [subscription if 'data.customer' in expand else {**subscription, 'customer': subscription['customer']['id']}
+                for subscription in page]
+        return {'object': 'list', 'url': '/v1/subscriptions', 'has_more': len(subscriptions) > limit, 'data': data}
+
+    def retrieve_subscription(self, account: str, subscription_id: str,
+                              params: List[Tuple[str, str]]) -> Tuple[int, Dict[str, Any]]:
+        expand = {value for key, value in params if key.startswith('expand')}
+        for subscription in self.stripe_subscriptions.get(account, []):
+            if subscription['id'] == subscription_id:
+                return 200, (subscription if 'customer' in expand
+                             else {**subscription, 'customer': subscription['customer']['id']})
+        return 404, {'error': {'type': 'invalid_request_error', 'code': 'resource_missing',
+                               'message': f"No such subscription: '{subscription_id}'"}}
+
+    def list_events(self, account: str, params: List[Tuple[str, str]]) -> Dict[str, Any]:
+        query = dict(params)
+        limit = min(int(query.get('limit', 10)), 100)
+        comparisons = {'gt': int.__gt__, 'gte': int.__ge__, 'lt': int.__lt__, 'lte': int.__le__}
+        bounds = [(comparisons[key[8:-1]], int(value)) for key, value in params
+                  if key.startswith('created[') and key[8:-1] in comparisons]
+        events = [event for event in self.stripe_events.get(account, [])
+                  if fnmatch.fnmatchcase(event['type'], query.get('type', '*'))
+                  and all(compare(event['created'], bound) for compare, bound in bounds)]
+        if query.get('starting_after'):
+            ids = [event['id'] for event in events]
+            start = ids.index(query['starting_after']) + 1 if query['starting_after'] in ids else len(ids)
+            events = events[start:]
+        return {'object': 'list', 'url': '/v1/events', 'has_more': len(events) > limit, 'data': events[:limit]}
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    backend: FakeBackends
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> Any:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if not body:
+            return None
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            return json.loads(body)
+        return dict(parse_qsl(body.decode()))
+
+    def _send(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _params(self) -> Tuple[str, List[Tuple[str, str]]]:
+        parts = urlsplit(self.path)
+        return parts.path, parse_qsl(parts.query, keep_blank_values=True)
+
+
+class _PostgrestHandler(_JsonHandler):
+    def _handle(self, method: str):
+        time.sleep(self.backend.latency)
+        path, params = self._params()
+        table = path.rsplit('/', 1)[-1]
+        endpoint = f'supabase {method} {table}'
+        try:
+            status, payload = self._dispatch(method, table, params)
+        except Exception as e:
+            status, payload = 400, {'code': 'PGRST100', 'message': str(e), 'details': None, 'hint': None}
+        self.backend._count(endpoint, status)
+        self._send(status, payload, {'Content-Range': f"0-{max(0, len(payload) - 1) if isinstance(payload, list) else 0}/*"})
+
+    def _dispatch(self, method: str, table: str, params: List[Tuple[str, str]]) -> Tuple[int, Any]:
+        if method == 'GET':
+            rows = self.backend.select(table, params)
+            if 'vnd.pgrst.object' in (self.headers.get('Accept') or ''):
+                if len(rows) != 1:
+                    return 406, {'code': 'PGRST116', 'details': f'The result contains {len(rows)} rows',
+                                 'hint': None, 'message': 'JSON object requested, multiple (or no) rows returned'}
+                return 200, rows[0]
+            return 200, rows
+
+        body = self._read_body()
+        if method == 'POST':
+            rows = body if isinstance(body, list) else [body]
+            prefer = self.headers.get('Prefer') or ''
+            on_conflict = dict(params).get('on_conflict', 'id') if 'merge-duplicates' in prefer else None
+            return 201, self.backend.write(table, rows, on_conflict)
+        if method == 'PATCH':
+            return 200, self.backend.update(table, params, body or {})
+        return 405, {'message': f'{method} is not supported by the fake PostgREST'}
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+
+class _StripeHandler(_JsonHandler):
+    def _handle(self, method: str):
+        time.sleep(self.backend.stripe_latency)
+        path, params = self._params()
+        # One endpoint for every subscription id
+        endpoint = f"stripe {method} {'/v1/subscriptions/{id}' if path.startswith('/v1/subscriptions/') else path}"
+        self._read_body()
+        if self.backend.should_rate_limit():
+            self.backend._count(endpoint, 429)
+            self._send(429, {'error': {'type': 'invalid_request_error', 'code': 'rate_limit',
+                                       'message': 'Request rate limit exceeded (injected by fake_backends)'}},
+                       {'Stripe-Should-Retry': 'true'})
+            return
+
+        account = self.headers.get('Stripe-Account')
+        if method == 'GET' and path == '/v1/subscriptions':
+            status, payload = 200, self.backend.list_subscriptions(account, params)
+        elif method == 'GET' and path.startswith('/v1/subscriptions/'):
+            status, payload = self.backend.retrieve_subscription(account, path.rsplit('/', 1)[-1], params)
+        elif method == 'GET' and path == '/v1/events':
+            status, payload = 200, self.backend.list_events(account, params)
+        else:
+            status, payload = 404, {'error': {'type': 'invalid_request_error',
+                                              'message': f'Unrecognized request URL ({method}: {path})'}}
+        self.backend._count(endpoint, status)
+        self._send(status, payload, {'Request-Id': f'req_{uuid.uuid4().hex[:14]}'})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the fake Supabase and Stripe servers")
+    parser.add_argument('--agencies', type=int, default=10)
+    parser.add_argument('--clients', type=int, default=50, help="Clients per agency")
+    parser.add_argument('--subscriptions', type=int, default=60, help="Stripe subscriptions per agency")
+    parser.add_argument('--services', type=int, default=20, help="Services per agency")
+    parser.add_argument('--tokens', type=int, default=100, help="Legacy checkout tokens per agency")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Delay added to every request")
+    parser.add_argument('--stripe-latency-ms', type=float, help="Delay for Stripe requests (default: --latency-ms)")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="Share of Stripe requests answered with 429")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    backend = FakeBackends(
+        build_dataset(args.agencies, args.clients, args.subscriptions, args.services, args.tokens),
+        latency_ms=args.latency_ms, stripe_latency_ms=args.stripe_latency_ms, rate_limit_ratio=args.rate_limit_ratio
+    ).start()
+    for name, value in backend.client_env().items():
+        print(f"export {name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        backend.stop()
@@ -1,5 +1,34 @@
-import base64
+import argparse
+import asyncio
+import csv
+import heapq
 import json
+import math
+import mmap
+import sys
+from collections import Counter
+
+from token_codec import decode_segment, extract, loads, payload_segment
+from token_minting import slim_service
+
+# Configuración de Supabase (solo para --from-db)
+SUPABASE_URL = "your_supabase_url"
+SUPABASE_SERVICE_ROLE_KEY = "your_supabase_service_role_key"
+
+# Límites habituales: una cookie no debería superar 4 KB y muchos proxies cortan cabeceras de 8 KB
+COOKIE_LIMIT_BYTES = 4096
+HEADER_LIMIT_BYTES = 8192
+# Un campo se considera sobredimensionado a partir de este tamaño (JSON compacto)
+OVERSIZED_FIELD_BYTES = 1024
+# Profundidad del desglose por campo (1 = solo claves de primer nivel)
+FIELD_DEPTH = 2
+# Límites superiores de los intervalos del histograma de tamaños (el último es abierto)
+HISTOGRAM_BOUNDS = [512, 1024, 2048, 4096, 8192, 16384, 32768]
+PERCENTILES = [50, 90, 95, 99]
+# Campos que se pueden recortar y cómo: ruta -> función que devuelve el valor podado
+PRUNE_RULES = {
+    'service': slim_service,
+}
 
 def calculate_token_size(token):
     """Calcula el tamaño de un token en bytes."""
@@ -14,25 +43,189 @@ def calculate_token_size(token):
     else:
         return f"{size_bytes / (1024 * 1024):.2f} MB ({size_bytes} bytes)"
 
+def compact_size(value):
+    """Bytes del valor serializado como JSON compacto."""
+    return len(json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+def base64_size(size_bytes):
+    return 4 * math.ceil(size_bytes / 3)
+
+def field_breakdown(payload, depth=FIELD_DEPTH, prefix=''):
+    """Tamaño en bytes de cada campo del payload (rutas con puntos hasta `depth` niveles)."""
+    sizes = {}
+    for key, value in payload.items():
+        path = f"{prefix}{key}"
+        sizes[path] = compact_size(value)
+        if isinstance(value, dict) and depth > 1:
+            sizes.update(field_breakdown(value, depth - 1, f"{path}."))
+    return sizes
+
+def find_duplicates(value, path=''):
+    """Listas con elementos repetidos: ruta -> (elementos duplicados, bytes que ocupan)."""
+    duplicates = {}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            duplicates.update(find_duplicates(child, f"{path}.{key}" if path else key))
+    elif isinstance(value, list):
+        seen = set()
+        count = wasted = 0
+        for item in value:
+            serialized = json.dumps(item, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+            if serialized in seen:
+                count += 1
+                wasted += len(serialized.encode('utf-8')) + 1  # +1 por la coma
+            else:
+                seen.add(serialized)
+        if count:
+            duplicates[path or '(root)'] = (count, wasted)
+    return duplicates
+
+def prune_savings(payload):
+    """Bytes que se ahorrarían aplicando PRUNE_RULES a los campos presentes."""
+    savings = {}
+    for path, prune in PRUNE_RULES.items():
+        value = payload
+        for key in path.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        if isinstance(value, dict):
+            saved = compact_size(value) - compact_size(prune(value))
+            if saved > 0:
+                savings[path] = saved
+    return savings
+
+def analyze_payload(payload, payload_bytes):
+    """Desglose de tamaño y ahorro estimado de un payload ya decodificado."""
+    fields = field_breakdown(payload)
+    duplicates = find_duplicates(payload)
+    pruned = prune_savings(payload)
+    return {
+        'payload_bytes': payload_bytes,
+        'fields': fields,
+        'duplicates': duplicates,
+        'oversized': [path for path, size in fields.items() if size >= OVERSIZED_FIELD_BYTES],
+        'savings': {
+            # Serializar sin espacios (como token_minting) ya reduce el payload
+            'compact': max(0, payload_bytes - compact_size(payload)),
+            'deduplication': sum(wasted for _, wasted in duplicates.values()),
+            'pruning': sum(pruned.values()),
+        },
+        'pruning_by_field': pruned,
+    }
+
+class TokenBudgetReport:
+    """Agrega el análisis de muchos tokens: tamaños por campo, duplicados y ahorro estimado."""
+
+    def __init__(self):
+        self.tokens = 0
+        self.invalid = 0
+        self.total_bytes = 0
+        self.max_bytes = 0
+        self.over_cookie_limit = 0
+        self.over_header_limit = 0
+        self.fields = {}
+        self.duplicates = {}
+        self.oversized = {}
+        self.savings = {'compact': 0, 'deduplication': 0, 'pruning': 0}
+
+    def add(self, token):
+        token = token.strip()
+        parts = token.split('.')
+        try:
+            if len(parts) != 3:
+                raise ValueError(f"{len(parts)} partes en lugar de 3")
+            payload_bytes = decode_segment(parts[1])
+            payload = loads(payload_bytes)
+            if not isinstance(payload, dict):
+                raise ValueError("el payload no es un objeto JSON")
+        except Exception:
+            self.invalid += 1
+            return None
+
+        size = len(token.encode('utf-8'))
+        self.tokens += 1
+        self.total_bytes += size
+        self.max_bytes = max(self.max_bytes, size)
+        self.over_cookie_limit += size > COOKIE_LIMIT_BYTES
+        self.over_header_limit += size > HEADER_LIMIT_BYTES
+
+        analysis = analyze_payload(payload, len(payload_bytes))
+        for path, field_size in analysis['fields'].items():
+            stats = self.fields.setdefault(path, {'tokens': 0, 'total_bytes': 0, 'max_bytes': 0})
+            stats['tokens'] += 1
+            stats['total_bytes'] += field_size
+            stats['max_bytes'] = max(stats['max_bytes'], field_size)
+        for path, (count, wasted) in analysis['duplicates'].items():
+            stats = self.duplicates.setdefault(path, {'tokens': 0, 'duplicates': 0, 'bytes': 0})
+            stats['tokens'] += 1
+            stats['duplicates'] += count
+            stats['bytes'] += wasted
+        for path in analysis['oversized']:
+            self.oversized[path] = self.oversized.get(path, 0) + 1
+        for kind, saved in analysis['savings'].items():
+            self.savings[kind] += saved
+        return analysis
+
+    def to_dict(self):
+        # El ahorro se mide sobre el JSON; en el token ocupa 4/3 por el base64
+        estimated_token_savings = {kind: base64_size(saved) for kind, saved in self.savings.items()}
+        return {
+            'tokens': self.tokens,
+            'invalid_tokens': self.invalid,
+            'total_bytes': self.total_bytes,
+            'average_bytes': self.total_bytes / self.tokens if self.tokens else 0,
+            'max_bytes': self.max_bytes,
+            'over_cookie_limit': self.over_cookie_limit,
+            'over_header_limit': self.over_header_limit,
+            'fields': dict(sorted(self.fields.items(), key=lambda item: -item[1]['total_bytes'])),
+            'duplicates': self.duplicates,
+            'oversized_fields': self.oversized,
+            'payload_savings_bytes': self.savings,
+            'estimated_token_savings_bytes': estimated_token_savings,
+            'estimated_savings_ratio': (
+                sum(estimated_token_savings.values()) / self.total_bytes if self.total_bytes else 0
+            ),
+        }
+
+    def print_summary(self, top=15):
+        report = self.to_dict()
+        print("Análisis de presupuesto de tokens:")
+        print("-----------------------------------")
+        print(f"Tokens analizados: {report['tokens']} (inválidos: {report['invalid_tokens']})")
+        print(f"Tamaño medio: {report['average_bytes']:.0f} bytes, máximo: {report['max_bytes']} bytes")
+        print(f"Por encima de {COOKIE_LIMIT_BYTES} bytes (cookie): {report['over_cookie_limit']}")
+        print(f"Por encima de {HEADER_LIMIT_BYTES} bytes (cabecera): {report['over_header_limit']}")
+
+        print(f"\nCampos más pesados (top {top}):")
+        for path, stats in list(report['fields'].items())[:top]:
+            average = stats['total_bytes'] / stats['tokens']
+            print(f"  {path:<40} media {average:>9.0f} B  máx {stats['max_bytes']:>9} B  en {stats['tokens']} tokens")
+
+        if report['duplicates']:
+            print("\nListas con elementos duplicados:")
+            for path, stats in report['duplicates'].items():
+                print(f"  {path:<40} {stats['duplicates']} duplicados en {stats['tokens']} tokens ({stats['bytes']} B)")
+
+        if report['oversized_fields']:
+            print(f"\nCampos de {OVERSIZED_FIELD_BYTES} bytes o más:")
+            for path, count in report['oversized_fields'].items():
+                print(f"  {path:<40} en {count} tokens")
+
+        print("\nAhorro estimado en los tokens:")
+        for kind, saved in report['estimated_token_savings_bytes'].items():
+            print(f"  {kind:<16} {saved} bytes")
+        print(f"  Total: {report['estimated_savings_ratio']:.1%} del tamaño actual")
+
 def analyze_jwt(token):
     parts = token.split('.')
     if len(parts) != 3:
         print(f"El token no parece ser un JWT válido (tiene {len(parts)} partes en lugar de 3)")
         return
     
-    # Función para decodificar correctamente cada parte del JWT
-    def decode_base64_url(b64string):
-        # Ajustar padding
-        padding = '=' * (4 - len(b64string) % 4)
-        # Reemplazar caracteres especiales de base64url
-        b64string = b64string.replace('-', '+').replace('_', '/')
-        return base64.b64decode(b64string + padding)
-    
-    # Analizar cada parte
+    # Analizar cada parte (base64 o base64url, el codec ajusta el padding)
     try:
-        header_bytes = decode_base64_url(parts[0])
-        payload_bytes = decode_base64_url(parts[1])
-        signature_bytes = decode_base64_url(parts[2])
+        header_bytes = decode_segment(parts[0])
+        payload_bytes = decode_segment(parts[1])
+        signature_bytes = decode_segment(parts[2])
     except Exception as e:
         print(f"Error al decodificar partes del token: {e}")
         return
@@ -52,6 +245,9 @@ def analyze_jwt(token):
     
     print("\nPrimeras 100 organizaciones en el payload (si existen):")
     payload_json = json.loads(payload_bytes)
+    if not isinstance(payload_json, dict):
+        print(f"El payload no es un objeto JSON ({type(payload_json).__name__})")
+        return
     try:
         orgs = payload_json.get('app_metadata', {}).get('organizations', [])
         print(f"Total organizaciones: {len(orgs)}")
@@ -59,8 +255,241 @@ def analyze_jwt(token):
     except:
         print("No se encontraron organizaciones en el payload")
 
+    analysis = analyze_payload(payload_json, len(payload_bytes))
+    print("\nDesglose por campo:")
+    for path, size in sorted(analysis['fields'].items(), key=lambda item: -item[1]):
+        print(f"  {path:<40} {size} bytes")
+    for path, (count, wasted) in analysis['duplicates'].items():
+        print(f"Duplicados en {path}: {count} elementos ({wasted} bytes)")
+    for kind, saved in analysis['savings'].items():
+        if saved:
+            print(f"Ahorro estimado por {kind}: {base64_size(saved)} bytes en el token")
+
+def read_token_file(path):
+    """Leer un token por línea sin cargar el archivo completo en memoria."""
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield line
+
+async def add_tokens_from_db(report, provider=None, limit=None):
+    """Analiza los tokens de la tabla a medida que llegan las páginas, sin acumularlos en memoria"""
+    # Import diferido: el análisis de archivos no necesita el cliente de Supabase
+    from clients import supabase_client
+    from supabase_paging import iter_rows
+
+    supabase = supabase_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+    def build_query():
+        query = supabase.table('tokens').select('id, access_token')
+        return query.eq('provider', provider) if provider else query
+
+    read = 0
+    async for row in iter_rows(build_query):
+        report.add(row['access_token'])
+        read += 1
+        if limit and read >= limit:
+            break
+
+def run_batch(args):
+    report = TokenBudgetReport()
+    if args.from_db:
+        asyncio.run(add_tokens_from_db(report, args.provider, args.limit))
+    else:
+        for token in read_token_file(args.file):
+            report.add(token)
+
+    report.print_summary(args.top)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report.to_dict(), f, indent=2, ensure_ascii=False)
+        print(f"\nReporte guardado en {args.json}")
+
+def iter_mmap_lines(path):
+    """Recorrer un volcado de tokens (uno por línea) mapeado en memoria: (nº de línea, offset, bytes)."""
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # archivo vacío
+            return
+        with mapped:
+            size = len(mapped)
+            start = 0
+            line_number = 0
+            while start < size:
+                end = mapped.find(b'\n', start)
+                if end == -1:
+                    end = size
+                line_number += 1
+                line = mapped[start:end].strip()
+                if line:
+                    yield line_number, start, line
+                start = end + 1
+
+def organizations_info(payload):
+    """(total de organizaciones, ¿son todas idénticas?) de app_metadata.organizations."""
+    orgs = extract(payload, 'app_metadata.organizations')
+    if not isinstance(orgs, list) or not orgs:
+        return 0, None
+    return len(orgs), len(orgs) > 1 and all(org == orgs[0] for org in orgs)
+
+class DumpStats:
+    """Estadísticas agregadas en memoria constante: tamaños exactos contados en un Counter
+    (pocos valores distintos), top N de tokens más grandes en un heap."""
+
+    def __init__(self, offenders=20):
+        self.sizes = Counter()
+        self.offenders = []
+        self.max_offenders = offenders
+        self.tokens = 0
+        self.invalid = 0
+        self.identical_orgs = 0
+
+    def add(self, line_number, offset, size, organizations, identical):
+        self.tokens += 1
+        self.sizes[size] += 1
+        if identical:
+            self.identical_orgs += 1
+        entry = (size, line_number, offset, organizations)
+        if len(self.offenders) < self.max_offenders:
+            heapq.heappush(self.offenders, entry)
+        elif size > self.offenders[0][0]:
+            heapq.heapreplace(self.offenders, entry)
+
+    def percentile(self, pct):
+        target = math.ceil(self.tokens * pct / 100)
+        seen = 0
+        for size in sorted(self.sizes):
+            seen += self.sizes[size]
+            if seen >= target:
+                return size
+        return 0
+
+    def histogram(self):
+        buckets = Counter()
+        for size, count in self.sizes.items():
+            bound = next((b for b in HISTOGRAM_BOUNDS if size < b), None)
+            label = f"<{bound}" if bound else f">={HISTOGRAM_BOUNDS[-1]}"
+            buckets[label] += count
+        labels = [f"<{b}" for b in HISTOGRAM_BOUNDS] + [f">={HISTOGRAM_BOUNDS[-1]}"]
+        return {label: buckets[label] for label in labels}
+
+    def to_dict(self):
+        total_bytes = sum(size * count for size, count in self.sizes.items())
+        return {
+            'tokens': self.tokens,
+            'invalid_tokens': self.invalid,
+            'total_bytes': total_bytes,
+            'average_bytes': total_bytes / self.tokens if self.tokens else 0,
+            'max_bytes': max(self.sizes) if self.sizes else 0,
+            'percentiles': {f"p{pct}": self.percentile(pct) for pct in PERCENTILES} if self.tokens else {},
+            'histogram': self.histogram(),
+            'over_cookie_limit': sum(c for size, c in self.sizes.items() if size > COOKIE_LIMIT_BYTES),
+            'over_header_limit': sum(c for size, c in self.sizes.items() if size > HEADER_LIMIT_BYTES),
+            'tokens_with_identical_organizations': self.identical_orgs,
+            'largest_tokens': [
+                {'bytes': size, 'line': line, 'offset': offset, 'organizations': orgs}
+                for size, line, offset, orgs in sorted(self.offenders, reverse=True)
+            ],
+        }
+
+    def print_summary(self):
+        report = self.to_dict()
+        print("Análisis del volcado de tokens:")
+        print("-----------------------------------")
+        print(f"Tokens: {report['tokens']} (inválidos: {report['invalid_tokens']})")
+        print(f"Tamaño medio: {report['average_bytes']:.0f} bytes, máximo: {report['max_bytes']} bytes")
+        for name, value in report['percentiles'].items():
+            print(f"  {name}: {value} bytes")
+        print("\nHistograma:")
+        for label, count in report['histogram'].items():
+            print(f"  {label:>8} {count}")
+        print(f"\nPor encima de {COOKIE_LIMIT_BYTES} bytes (cookie): {report['over_cookie_limit']}")
+        print(f"Por encima de {HEADER_LIMIT_BYTES} bytes (cabecera): {report['over_header_limit']}")
+        print(f"Tokens con organizaciones idénticas: {report['tokens_with_identical_organizations']}")
+        print("\nTokens más grandes:")
+        for offender in report['largest_tokens']:
+            print(f"  línea {offender['line']:>8}: {offender['bytes']} bytes ({offender['organizations']} organizaciones)")
+
+def run_dump(args):
+    """Modo streaming: el volcado se mapea en memoria y nunca se carga entero."""
+    stats = DumpStats(args.offenders)
+    budget = TokenBudgetReport() if args.fields else None
+    csv_file = open(args.csv, 'w', newline='', encoding='utf-8') if args.csv else None
+    writer = csv.writer(csv_file) if csv_file else None
+    if writer:
+        writer.writerow(['line', 'offset', 'bytes', 'payload_bytes', 'organizations', 'identical_organizations', 'valid'])
+
+    try:
+        for line_number, offset, line in iter_mmap_lines(args.dump):
+            token = line.decode('utf-8', errors='replace')
+            try:
+                raw_payload = decode_segment(payload_segment(token))
+                payload = loads(raw_payload)
+                payload_bytes = len(raw_payload)
+                if not isinstance(payload, dict):
+                    raise ValueError("el payload no es un objeto JSON")
+            except Exception:
+                stats.invalid += 1
+                if writer:
+                    writer.writerow([line_number, offset, len(line), '', '', '', False])
+                continue
+
+            organizations, identical = organizations_info(payload)
+            stats.add(line_number, offset, len(line), organizations, identical)
+            if budget:
+                budget.add(token)
+            if writer:
+                writer.writerow([line_number, offset, len(line), payload_bytes, organizations,
+                                 '' if identical is None else identical, True])
+    finally:
+        if csv_file:
+            csv_file.close()
+
+    stats.print_summary()
+    if budget:
+        print()
+        budget.print_summary(args.top)
+
+    if args.json:
+        report = stats.to_dict()
+        if budget:
+            report['budget'] = budget.to_dict()
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nReporte guardado en {args.json}")
+    if args.csv:
+        print(f"Detalle por token guardado en {args.csv}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Analizador de tamaño de tokens JWT")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--file', help="Archivo con un token por línea")
+    source.add_argument('--from-db', action='store_true', help="Leer los tokens de la tabla tokens")
+    source.add_argument('--dump', help="Volcado de tokens (uno por línea) de cualquier tamaño, procesado con mmap")
+    parser.add_argument('--provider', help="Filtrar por provider al leer de la base de datos (p. ej. suuper)")
+    parser.add_argument('--limit', type=int, help="Máximo de tokens a leer de la base de datos")
+    parser.add_argument('--top', type=int, default=15, help="Campos a mostrar en el ranking")
+    parser.add_argument('--json', help="Guardar el reporte completo en este archivo JSON")
+    parser.add_argument('--csv', help="(--dump) Guardar una fila por token en este archivo CSV")
+    parser.add_argument('--offenders', type=int, default=20, help="(--dump) Tokens más grandes a listar")
+    parser.add_argument('--fields', action='store_true', help="(--dump) Incluir también el desglose por campo")
+    args = parser.parse_args()
+    if not (args.file or args.from_db or args.dump):
+        parser.error("indica --file, --from-db o --dump")
+    return args
+
 # Para usar como script independiente
 if __name__ == "__main__":
+    # Con argumentos se usa el modo por lotes; sin ellos, el modo interactivo
+    if len(sys.argv) > 1:
+        args = parse_args()
+        if args.dump:
+            run_dump(args)
+        else:
+            run_batch(args)
+        exit(0)
+
     print("Analizador de tamaño de tokens JWT")
     print("==================================")
     
@@ -0,0 +1,206 @@
+"""Request-level metrics (counts, errors, latency histogram, bytes) per endpoint for the Supabase and Stripe calls."""
+import bisect
+import json
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Upper bounds of the latency buckets in milliseconds (the last bucket is open)
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+PROMETHEUS_PREFIX = 'migration'
+
+enabled = False
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.count = 0
+        self.errors: Counter = Counter()
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+
+    def add(self, seconds: float, size: int, error: Optional[str]):
+        self.count += 1
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes += size
+        if error is not None:
+            self.errors[error] += 1
+
+    def percentile_ms(self, percentile: float) -> float:
+        """Upper bound of the bucket holding the percentile (max latency for the open bucket)."""
+        rank = percentile / 100 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else self.max_seconds * 1000
+        return 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'errors': dict(self.errors),
+            'total_seconds': round(self.total_seconds, 6),
+            'mean_ms': round(self.total_seconds / self.count * 1000, 3) if self.count else 0.0,
+            'p50_ms': self.percentile_ms(50),
+            'p95_ms': self.percentile_ms(95),
+            'max_ms': round(self.max_seconds * 1000, 3),
+            'bytes': self.bytes,
+            'latency_buckets_ms': dict(zip([str(bound) for bound in LATENCY_BUCKETS_MS] + ['+Inf'], self.buckets)),
+        }
+
+
+_lock = threading.Lock()
+_endpoints: Dict[Tuple[str, str], EndpointMetrics] = {}
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def reset():
+    with _lock:
+        _endpoints.clear()
+
+
+def supabase_endpoint(query: Any) -> str:
+    """'GET /tokens', 'POST /client_subscriptions', ... from a postgrest request builder."""
+    request = getattr(query, 'request', None)
+    method = getattr(request, 'http_method', None) or getattr(query, 'http_method', None)
+    path = getattr(request, 'path', None) or getattr(query, 'path', None)
+    method = getattr(method, 'value', method) or type(query).__name__
+    table = str(path).rstrip('/').rsplit('/', 1)[-1] if path else '?'
+    return f"{method} /{table}"
+
+
+def stripe_endpoint(fn: Callable[..., Any]) -> str:
+    """'Subscription.list', 'Customer.create', ... from the called Stripe method."""
+    owner = getattr(fn, '__self__', None)
+    if isinstance(owner, type):
+        return f"{owner.__name__}.{fn.__name__}"
+    return getattr(fn, '__qualname__', repr(fn))
+
+
+def _response_size(result: Any) -> int:
+    last_response = getattr(result, 'last_response', None)  # Stripe objects keep the raw body
+    body = getattr(last_response, 'body', None)
+    if body is not None:
+        return len(body)
+    data = getattr(result, 'data', result)  # postgrest APIResponse
+    try:
+        return len(json.dumps(data, separators=(',', ':'), default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _error_label(error: Exception) -> str:
+    status = getattr(error, 'http_status', None) or getattr(error, 'code', None)
+    return str(status) if status else type(error).__name__
+
+
+def observe(backend: str, endpoint: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Call `fn` and record its latency, response size and outcome (blocking)."""
+    start = time.perf_counter()
+    error = None
+    result = None
+    try:
+        result = fn(*args, **kwargs)
+        return result
+    except Exception as e:
+        error = _error_label(e)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        size = _response_size(result) if error is None else 0
+        with _lock:
+            metrics = _endpoints.get((backend, endpoint))
+            if metrics is None:
+                metrics = _endpoints[(backend, endpoint)] = EndpointMetrics()
+            metrics.add(seconds, size, error)
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    with _lock:
+        return {f"{backend} {endpoint}": metrics.to_dict()
+                for (backend, endpoint), metrics in sorted(_endpoints.items())}
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def print_summary(wall_seconds: Optional[float] = None):
+    data = snapshot()
+    if not data:
+        print("No Supabase/Stripe requests recorded")
+        return
+    print(f"\n{'endpoint':<42} {'count':>7} {'errors':>7} {'mean ms':>8} {'p50 ms':>7} {'p95 ms':>7} "
+          f"{'max ms':>8} {'bytes':>9} {'total s':>8}")
+    totals: Counter = Counter()
+    for name, metrics in data.items():
+        print(f"{name:<42} {metrics['count']:>7} {sum(metrics['errors'].values()):>7} {metrics['mean_ms']:>8.1f} "
+              f"{metrics['p50_ms']:>7.0f} {metrics['p95_ms']:>7.0f} {metrics['max_ms']:>8.1f} "
+              f"{_format_bytes(metrics['bytes']):>9} {metrics['total_seconds']:>8.2f}")
+        totals[name.split(' ', 1)[0]] += metrics['total_seconds']
+    # Requests overlap, so the per-backend time is cumulative and can exceed the wall time
+    spent = ", ".join(f"{backend}: {seconds:.2f}s" for backend, seconds in totals.items())
+    print(f"\nCumulative request time ({spent})" + (f" over {wall_seconds:.2f}s wall" if wall_seconds else ""))
+
+
+def write_json(path: str, extra: Optional[Dict[str, Any]] = None):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({**(extra or {}), 'endpoints': snapshot()}, f, indent=2)
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def write_prometheus(path: str):
+    """Write the metrics in the Prometheus text exposition format (e.g. for a textfile collector)."""
+    prefix = PROMETHEUS_PREFIX
+    with _lock:
+        items = sorted(_endpoints.items())
+    lines = [
+        f"# HELP {prefix}_requests_total Requests sent per backend endpoint.",
+        f"# TYPE {prefix}_requests_total counter",
+    ]
+    lines += [f'{prefix}_requests_total{{backend="{_label(b)}",endpoint="{_label(e)}"}} {m.count}' for (b, e), m in items]
+    lines += [
+        f"# HELP {prefix}_request_errors_total Failed requests per backend endpoint and status.",
+        f"# TYPE {prefix}_request_errors_total counter",
+    ]
+    for (backend, endpoint), metrics in items:
+        for status, count in sorted(metrics.errors.items()):
+            lines.append(f'{prefix}_request_errors_total{{backend="{_label(backend)}",endpoint="{_label(endpoint)}",'
+                         f'status="{_label(status)}"}} {count}')
+    lines += [
+        f"# HELP {prefix}_response_bytes_total Approximate response bytes per backend endpoint.",
+        f"# TYPE {prefix}_response_bytes_total counter",
+    ]
+    lines += [f'{prefix}_response_bytes_total{{backend="{_label(b)}",endpoint="{_label(e)}"}} {m.bytes}' for (b, e), m in items]
+    lines += [
+        f"# HELP {prefix}_request_duration_seconds Request latency per backend endpoint.",
+        f"# TYPE {prefix}_request_duration_seconds histogram",
+    ]
+    for (backend, endpoint), metrics in items:
+        labels = f'backend="{_label(backend)}",endpoint="{_label(endpoint)}"'
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS_MS + [None], metrics.buckets):
+            cumulative += bucket_count
+            le = '+Inf' if bound is None else f"{bound / 1000:g}"
+            lines.append(f'{prefix}_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f'{prefix}_request_duration_seconds_sum{{{labels}}} {metrics.total_seconds:.6f}')
+        lines.append(f'{prefix}_request_duration_seconds_count{{{labels}}} {metrics.count}')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
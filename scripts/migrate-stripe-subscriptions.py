@@ -1,12 +1,27 @@
 import os
+import argparse
 import stripe
 import json
-from datetime import datetime
-from supabase import create_client, Client
-from typing import Dict, List, Optional, Any
+from datetime import datetime, timezone
+from supabase import Client
+from typing import Dict, Iterator, List, Optional, Any, Tuple
 import asyncio
+import time
+import uuid
+from collections import Counter
 from tqdm import tqdm
 
+import async_io
+import instrumentation
+from async_io import chunked, execute, run_io, write_with_row_fallback
+from clients import configure_stripe, supabase_client
+from checkpoint import CheckpointJournal
+from pg_backend import BACKENDS, PostgresWriter
+from supabase_paging import fetch_all
+from sync_state import SyncState
+import stripe_throttle
+from stripe_throttle import call_stripe
+
 # Colores para la consola
 GREEN = "\033[92m"
 RED = "\033[91m"
@@ -19,20 +34,54 @@ SUPABASE_URL = "your_supabase_url"
 SUPABASE_SERVICE_ROLE_KEY = "your_supabase_service_role_key"
 STRIPE_SECRET_KEY = "your_stripe_secret_key"
 
+# Estados de Stripe que se sincronizan (el filtro se aplica en la API, no en Python)
+SYNC_STATUSES = ['active', 'trialing', 'past_due']
+# Tamaño de página para la paginación de Stripe (máximo permitido: 100)
+STRIPE_PAGE_SIZE = 100
+# Número de cuentas conectadas que se consultan en paralelo
+AGENCY_CONCURRENCY = int(os.getenv('AGENCY_CONCURRENCY', '5'))
+# Tamaño de los lotes de in_() al precargar datos de Supabase
+SUPABASE_IN_CHUNK_SIZE = 100
+# Filas de client_subscriptions por cada upsert
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '500'))
+# Diario de progreso para reanudar con --resume
+CHECKPOINT_FILE = 'migrate_stripe_subscriptions.checkpoint.jsonl'
+# Modo incremental (--since): marca de agua por cuenta conectada y eventos que se leen
+SYNC_STATE_FILE = 'migrate_stripe_subscriptions.state.json'
+SUBSCRIPTION_EVENT_TYPES = 'customer.subscription.*'
+# Stripe solo conserva 30 días de eventos; con una marca más antigua se hace el escaneo completo
+EVENT_RETENTION_SECONDS = 30 * 86400
+# Columnas de client_subscriptions que se precargan y comparan antes de actualizar
+DIFF_COLUMNS = [
+    'billing_subscription_id', 'billing_customer_id', 'billing_provider', 'period_starts_at',
+    'period_ends_at', 'trial_starts_at', 'trial_ends_at', 'status', 'active'
+]
+TIMESTAMP_COLUMNS = {'period_starts_at', 'period_ends_at', 'trial_starts_at', 'trial_ends_at'}
+
 # Configurar Stripe
-stripe.api_key = STRIPE_SECRET_KEY
+configure_stripe(STRIPE_SECRET_KEY)
 
 # Inicializar cliente de Supabase
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+supabase: Client = supabase_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+# Con --backend postgres las escrituras van directo a la base de datos (ver pg_backend.py)
+pg_writer: Optional[PostgresWriter] = None
 
 # Contadores globales
 stats = {
     'processed_agencies': 0,
     'successful_syncs': 0,
     'failed_syncs': 0,
+    'skipped_agencies': 0,
+    'skipped_subscriptions': 0,
+    'skipped_inactive': 0,
+    'unchanged_subscriptions': 0,
+    'incremental_agencies': 0,
+    'full_scan_agencies': 0,
     'created_subscriptions': 0,
     'updated_subscriptions': 0,
-    'missing_emails': []
+    'missing_emails': [],
+    'failed_writes': []
 }
 
 def log_success(message: str):
@@ -50,9 +99,9 @@ def log_info(message: str):
 async def get_billing_accounts_stripe() -> List[Dict[str, Any]]:
     """Obtener todas las billing accounts de tipo Stripe"""
     try:
-        response = supabase.table('billing_accounts').select(
+        response = await execute(supabase.table('billing_accounts').select(
             'provider_id, account_id, accounts(id, email, name)'
-        ).eq('provider', 'stripe').execute()
+        ).eq('provider', 'stripe'))
         
         if response.data:
             log_success(f"Encontradas {len(response.data)} cuentas de Stripe")
@@ -64,147 +113,336 @@ async def get_billing_accounts_stripe() -> List[Dict[str, Any]]:
         log_error(f"Error obteniendo billing accounts: {str(e)}")
         return []
 
-async def get_stripe_subscriptions(stripe_account_id: str) -> List[Dict[str, Any]]:
-    """Obtener suscripciones activas de una cuenta conectada de Stripe"""
+def iter_stripe_subscriptions(stripe_account_id: str) -> Iterator[Any]:
+    """Recorrer página a página las suscripciones sincronizables de una cuenta (un listado por estado, customer expandido)"""
+    for status in SYNC_STATUSES:
+        starting_after = None
+        while True:
+            page = call_stripe(
+                stripe.Subscription.list,
+                status=status,
+                stripe_account=stripe_account_id,
+                limit=STRIPE_PAGE_SIZE,
+                expand=['data.customer'],
+                **({'starting_after': starting_after} if starting_after else {})
+            )
+            yield from page.data
+            if not page.has_more or not page.data:
+                break
+            starting_after = page.data[-1].id
+
+async def get_stripe_subscriptions(stripe_account_id: str) -> Optional[List[Dict[str, Any]]]:
+    """Obtener suscripciones activas de una cuenta conectada de Stripe (None si el listado falla)"""
     try:
-        subscriptions = stripe.Subscription.list(
-            status='all',
-            stripe_account=stripe_account_id,
-            limit=100
+        # La paginación es bloqueante: se ejecuta en el pool de I/O para consultar varias cuentas a la vez
+        active_subscriptions = await run_io(
+            lambda: list(iter_stripe_subscriptions(stripe_account_id))
         )
         
-        active_subscriptions = [
-            sub for sub in subscriptions.data 
-            if sub.status in ['active', 'trialing', 'past_due']
-        ]
-        
         log_info(f"Encontradas {len(active_subscriptions)} suscripciones activas en cuenta {stripe_account_id}")
         return active_subscriptions
         
     except Exception as e:
         log_error(f"Error obteniendo suscripciones de Stripe para cuenta {stripe_account_id}: {str(e)}")
-        return []
+        return None
 
-async def get_customer_email(customer_id: str, stripe_account_id: str) -> Optional[str]:
-    """Obtener email del customer desde Stripe"""
-    try:
-        customer = stripe.Customer.retrieve(
-            customer_id,
-            stripe_account=stripe_account_id
+def list_changed_subscription_ids(stripe_account_id: str, mark: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+    """Ids de las suscripciones con eventos desde la marca (sin los ya aplicados en su segundo) y la nueva marca"""
+    applied = set(mark.get('event_ids', []))
+    changed: Dict[str, None] = {}
+    latest_created = None
+    latest_ids: List[str] = []
+    starting_after = None
+    while True:
+        page = call_stripe(
+            stripe.Event.list,
+            type=SUBSCRIPTION_EVENT_TYPES,
+            created={'gte': mark['created']},
+            stripe_account=stripe_account_id,
+            limit=STRIPE_PAGE_SIZE,
+            **({'starting_after': starting_after} if starting_after else {})
         )
-        return customer.email
-    except Exception as e:
-        log_error(f"Error obteniendo email del customer {customer_id}: {str(e)}")
+        for event in page.data:
+            if event.id in applied:
+                continue
+            if latest_created is None:
+                latest_created = event.created
+            if event.created == latest_created:
+                latest_ids.append(event.id)
+            changed.setdefault(event['data']['object']['id'], None)
+        if not page.has_more or not page.data:
+            break
+        starting_after = page.data[-1].id
+
+    if latest_created is None:
+        return [], mark
+    if latest_created == mark['created']:
+        latest_ids += applied
+    return list(changed), {'created': latest_created, 'event_ids': latest_ids}
+
+async def get_changed_subscriptions(stripe_account_id: str, mark: Dict[str, Any]) -> Tuple[List[Any], Dict[str, Any]]:
+    """Estado actual (con el customer expandido) de las suscripciones modificadas desde la marca"""
+    subscription_ids, new_mark = await run_io(list_changed_subscription_ids, stripe_account_id, mark)
+
+    async def retrieve(subscription_id: str) -> Optional[Any]:
+        try:
+            return await run_io(call_stripe, stripe.Subscription.retrieve, subscription_id,
+                                stripe_account=stripe_account_id, expand=['customer'])
+        except Exception as e:
+            if getattr(e, 'http_status', None) != 404:
+                raise
+            log_warning(f"Suscripción {subscription_id} no encontrada en {stripe_account_id}: {str(e)}")
+            return None
+
+    subscriptions = await asyncio.gather(*[retrieve(subscription_id) for subscription_id in subscription_ids])
+    log_info(f"{len(subscription_ids)} suscripciones con cambios en cuenta {stripe_account_id}")
+    return [subscription for subscription in subscriptions if subscription is not None], new_mark
+
+def parse_since(value: str) -> Optional[int]:
+    """'state' (marca guardada), un timestamp Unix o una fecha ISO (sin zona = UTC)"""
+    if value == 'state':
         return None
+    if value.isdigit():
+        return int(value)
+    since = datetime.fromisoformat(value)
+    return int((since if since.tzinfo else since.replace(tzinfo=timezone.utc)).timestamp())
 
-async def find_client_by_email(email: str, agency_id: str) -> Optional[Dict[str, Any]]:
-    """Buscar cliente en la base de datos por email"""
-    try:
-        # Buscar en accounts con el email
-        account_response = supabase.table('accounts').select(
-            'id, email'
-        ).eq('email', email).single().execute()
-        
-        if account_response.data:
-            user_id = account_response.data['id']
-            
-            # Buscar cliente asociado a esta agencia
-            client_response = supabase.table('clients').select(
-                'id, user_client_id, organization_client_id'
-            ).eq('agency_id', agency_id).eq('user_client_id', user_id).single().execute()
-            
-            if client_response.data:
-                return client_response.data
-                
-    except Exception as e:
-        if "PGRST116" not in str(e):  # No encontrado
-            log_error(f"Error buscando cliente por email {email}: {str(e)}")
-    
-    return None
+def get_customer_id(subscription: Any) -> str:
+    """Obtener el id del customer, esté o no expandido en la suscripción"""
+    customer = subscription.customer
+    return customer if isinstance(customer, str) else customer.id
 
-async def check_existing_subscription(billing_customer_id: str) -> Optional[str]:
-    """Verificar si ya existe una suscripción para este customer"""
-    try:
-        response = supabase.table('client_subscriptions').select(
-            'id'
-        ).eq('billing_customer_id', billing_customer_id).eq('billing_provider', 'stripe').single().execute()
-        
-        if response.data:
-            return response.data['id']
-    except Exception as e:
-        if "PGRST116" not in str(e):
-            log_error(f"Error verificando suscripción existente: {str(e)}")
-    
-    return None
+def get_customer_email(subscription: Any) -> Optional[str]:
+    """Obtener email del customer expandido en la suscripción (sin llamadas extra a Stripe)"""
+    customer = subscription.customer
+    if isinstance(customer, str) or getattr(customer, 'deleted', False):
+        return None
+    return getattr(customer, 'email', None)
 
-async def create_client_subscription(client_id: str, subscription: Any, customer_email: str) -> bool:
-    """Crear nueva client subscription"""
-    try:
-        log_info(f"Creando suscripción para cliente {client_id} - Email: {customer_email}, ID: {subscription.id}, Status: {subscription.status}")
-        subscription_data = {
-            'client_id': client_id,
-            'billing_subscription_id': subscription.id,
-            'billing_customer_id': subscription.customer,
-            'billing_provider': 'stripe',
-            'period_starts_at': datetime.fromtimestamp(subscription['items']['data'][0]['current_period_start']).isoformat() if subscription['items']['data'][0]['current_period_start'] else None,
-            'period_ends_at': datetime.fromtimestamp(subscription['items']['data'][0]['current_period_end']).isoformat() if subscription['items']['data'][0]['current_period_end'] else None,
-            'trial_starts_at': datetime.fromtimestamp(subscription['items']['data'][0]['trial_start']).isoformat() if subscription.status in ['trialing'] else None,
-            'trial_ends_at': datetime.fromtimestamp(subscription['items']['data'][0]['trial_end']).isoformat() if subscription.status in ['trialing'] else None,
-            'currency': subscription.currency,
-            'status': subscription.status,
-            'active': subscription.status in ['active', 'trialing'],
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat()
-        }
-        
-        response = supabase.table('client_subscriptions').insert(subscription_data).execute()
-        
-        if response.data:
-            log_success(f"Suscripción creada para cliente {client_id} - Email: {customer_email}")
+async def prefetch_agency_index(agency_id: str, customer_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Precargar en memoria los clientes por email y las client_subscriptions por customer de una agencia"""
+    clients = await fetch_all(
+        lambda: supabase.table('clients').select(
+            'id, user_client_id, organization_client_id'
+        ).eq('agency_id', agency_id)
+    )
+
+    clients_by_user = {client['user_client_id']: client for client in clients}
+
+    # Los lotes de in_() se lanzan en paralelo a través del pool de I/O
+    account_responses = await asyncio.gather(*[
+        execute(supabase.table('accounts').select('id, email').in_('id', user_ids))
+        for user_ids in chunked(list(clients_by_user), SUPABASE_IN_CHUNK_SIZE)
+    ])
+    clients_by_email = {}
+    for accounts in account_responses:
+        for account in accounts.data or []:
+            if account.get('email'):
+                clients_by_email.setdefault(account['email'], clients_by_user[account['id']])
+
+    subscription_responses = await asyncio.gather(*[
+        execute(supabase.table('client_subscriptions').select(
+            ', '.join(['id', 'client_id', *DIFF_COLUMNS])
+        ).eq('billing_provider', 'stripe').in_('billing_customer_id', customer_chunk))
+        for customer_chunk in chunked(list(dict.fromkeys(customer_ids)), SUPABASE_IN_CHUNK_SIZE)
+    ])
+    subscriptions_by_customer = {}
+    for existing in subscription_responses:
+        for row in existing.data or []:
+            subscriptions_by_customer.setdefault(row['billing_customer_id'], row)
+
+    return {
+        'clients_by_email': clients_by_email,
+        'subscriptions_by_customer': subscriptions_by_customer
+    }
+
+class ClientSubscriptionWriter:
+    """Acumula filas de client_subscriptions y las guarda con upserts por lotes (fila a fila si un lote falla)"""
+
+    def __init__(self, agency_name: str, batch_size: int = WRITE_BATCH_SIZE,
+                 journal: Optional[CheckpointJournal] = None, agency_key: Optional[str] = None,
+                 dry_run: bool = False):
+        self.agency_name = agency_name
+        self.batch_size = max(1, batch_size)
+        self.journal = journal
+        self.agency_key = agency_key
+        self.dry_run = dry_run
+        self.pending: List[Dict[str, Any]] = []
+        # Filas nuevas aún sin guardar (y las que no se pudieron crear), por id
+        self.pending_created: Dict[str, Dict[str, Any]] = {}
+        self.failed_created: set = set()
+        self.succeeded = 0
+        self.failed = 0
+        self.changes: Counter = Counter()
+        self.changed_columns: Counter = Counter()
+
+    async def add(self, row: Dict[str, Any], kind: str, subscription_id: str, customer_email: str):
+        entry = {'row': row, 'kind': kind, 'subscription_id': subscription_id, 'email': customer_email}
+        self.changes[kind] += 1
+        if kind == 'updated':
+            self.changed_columns.update(column for column in row if column not in ('id', 'client_id', 'updated_at'))
+        if self.dry_run:
+            self._record_success(entry)
+            return
+        created = self.pending_created.get(row['id']) if kind == 'updated' else None
+        if created:
+            # Actualiza una fila creada en este mismo lote: se funde con la creación para no
+            # escribirla antes de que exista
+            created['row'].update(row)
+            created.setdefault('merged', []).append(entry)
+            return
+        if kind == 'updated' and row['id'] in self.failed_created:
+            self._record_failure(entry, "no se pudo crear la fila que actualiza")
+            return
+        if kind == 'created':
+            self.pending_created[row['id']] = entry
+        self.pending.append(entry)
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        pending, self.pending, self.pending_created = self.pending, [], {}
+        # PostgREST exige las mismas claves en todas las filas de un lote
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for entry in pending:
+            groups.setdefault(tuple(sorted(entry['row'])), []).append(entry)
+        for entries in groups.values():
+            for batch in chunked(entries, self.batch_size):
+                await self._write_batch(batch)
+
+    async def _write_batch(self, batch: List[Dict[str, Any]]):
+        saved = await write_with_row_fallback(
+            lambda entries: self._upsert([entry['row'] for entry in entries]), batch, self._fail_entry,
+            lambda entries, e: log_warning(f"Lote de {len(entries)} suscripciones falló ({str(e)}), reintentando fila a fila")
+        )
+        if not saved:
+            return
+
+        entries = [entry for saved_entry in saved for entry in [saved_entry, *saved_entry.get('merged', [])]]
+        for entry in entries:
+            self._record_success(entry)
+        if self.journal:
+            self.journal.mark_many_done(
+                'subscription', [entry['subscription_id'] for entry in entries], agency=self.agency_key
+            )
+        log_success(f"Guardadas {len(saved)} suscripciones de {self.agency_name}")
+
+    def _fail_entry(self, entry: Dict[str, Any], error: Exception):
+        if entry['kind'] == 'created':
+            self.failed_created.add(entry['row']['id'])
+        for failed in [entry, *entry.get('merged', [])]:
+            self._record_failure(failed, str(error))
+
+    async def _upsert(self, rows: List[Dict[str, Any]]):
+        if pg_writer is not None:
+            # COPY a una tabla temporal + INSERT ... ON CONFLICT (id) DO UPDATE, en una transacción
+            await run_io(pg_writer.upsert, 'client_subscriptions', rows, 'id')
+            return
+        # missing=default: las columnas que no vienen en el lote usan su valor por defecto al insertar
+        await execute(supabase.table('client_subscriptions').upsert(
+            rows, on_conflict='id', default_to_null=False
+        ))
+
+    def skip_unchanged(self, subscription_id: str):
+        """La fila ya refleja la suscripción: no se escribe (ni se toca updated_at)"""
+        self.changes['unchanged'] += 1
+        stats['unchanged_subscriptions'] += 1
+        if self.journal:
+            self.journal.mark_done('subscription', subscription_id, agency=self.agency_key)
+
+    def summary(self) -> str:
+        columns = ", ".join(f"{column} ({count})" for column, count in self.changed_columns.most_common())
+        return (f"{self.changes['created']} nuevas, {self.changes['updated']} actualizadas, "
+                f"{self.changes['unchanged']} sin cambios" + (f"; columnas: {columns}" if columns else ""))
+
+    def _record_success(self, entry: Dict[str, Any]):
+        self.succeeded += 1
+        stats['successful_syncs'] += 1
+        if entry['kind'] == 'created':
             stats['created_subscriptions'] += 1
-            return True
         else:
-            log_error(f"Error creando suscripción para {customer_email}")
-            return False
-            
-    except Exception as e:
-        log_error(f"Error creando client subscription para {customer_email}: {str(e)}")
-        return False
-
-async def update_client_subscription(subscription_id: str, subscription: Any, customer_email: str) -> bool:
-    """Actualizar suscripción existente"""
-    try:
-        update_data = {
-            'billing_subscription_id': subscription.id,
-            'period_starts_at': datetime.fromtimestamp(subscription['items']['data'][0]['current_period_start']).isoformat() if subscription['items']['data'][0]['current_period_start'] else None,
-            'period_ends_at': datetime.fromtimestamp(subscription['items']['data'][0]['current_period_end']).isoformat() if subscription['items']['data'][0]['current_period_end'] else None,
-            'trial_starts_at': datetime.fromtimestamp(subscription['items']['data'][0]['trial_start']).isoformat() if subscription.status in ['trialing'] else None,
-            'trial_ends_at': datetime.fromtimestamp(subscription['items']['data'][0]['trial_end']).isoformat() if subscription.status in ['trialing'] else None,
-            'status': subscription.status,
-            'active': subscription.status in ['active', 'trialing'],
-            'updated_at': datetime.now().isoformat()
-        }
-        
-        response = supabase.table('client_subscriptions').update(update_data).eq('id', subscription_id).execute()
-        
-        if response.data:
-            log_success(f"Suscripción actualizada para email: {customer_email}")
             stats['updated_subscriptions'] += 1
-            return True
-        else:
-            log_error(f"Error actualizando suscripción para {customer_email}")
-            return False
-            
-    except Exception as e:
-        log_error(f"Error actualizando client subscription para {customer_email}: {str(e)}")
-        return False
+
+    def _record_failure(self, entry: Dict[str, Any], error: str):
+        self.failed += 1
+        stats['failed_syncs'] += 1
+        stats['failed_writes'].append({
+            'subscription_id': entry['subscription_id'],
+            'email': entry['email'],
+            'agency': self.agency_name,
+            'operation': entry['kind'],
+            'error': error
+        })
+        log_error(f"Error guardando suscripción {entry['subscription_id']} para {entry['email']}: {error}")
+
+def subscription_period_data(subscription: Any) -> Dict[str, Any]:
+    """Campos de periodo y estado comunes a la creación y la actualización"""
+    item = subscription['items']['data'][0]
+    return {
+        'billing_subscription_id': subscription.id,
+        'period_starts_at': datetime.fromtimestamp(item['current_period_start']).isoformat() if item['current_period_start'] else None,
+        'period_ends_at': datetime.fromtimestamp(item['current_period_end']).isoformat() if item['current_period_end'] else None,
+        'trial_starts_at': datetime.fromtimestamp(item['trial_start']).isoformat() if subscription.status in ['trialing'] else None,
+        'trial_ends_at': datetime.fromtimestamp(item['trial_end']).isoformat() if subscription.status in ['trialing'] else None,
+        'status': subscription.status,
+        'active': subscription.status in ['active', 'trialing']
+    }
+
+async def create_client_subscription(writer: ClientSubscriptionWriter, client_id: str, subscription: Any, customer_email: str) -> Dict[str, Any]:
+    """Encolar nueva client subscription y devolver la fila creada"""
+    subscription_data = {
+        'id': str(uuid.uuid4()),
+        'client_id': client_id,
+        'billing_customer_id': get_customer_id(subscription),
+        'billing_provider': 'stripe',
+        **subscription_period_data(subscription),
+        'currency': subscription.currency,
+        'created_at': datetime.now().isoformat(),
+        'updated_at': datetime.now().isoformat()
+    }
+    await writer.add(subscription_data, 'created', subscription.id, customer_email)
+    return subscription_data
+
+def normalize_column(column: str, value: Any) -> Any:
+    """Valor comparable: las fechas pasan a datetime con zona (sin zona = UTC, como las guarda Postgres)"""
+    if value is None or column not in TIMESTAMP_COLUMNS:
+        return value
+    parsed = datetime.fromisoformat(value) if isinstance(value, str) else value
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def diff_subscription_row(existing: Dict[str, Any], desired: Dict[str, Any]) -> Dict[str, Any]:
+    """Columnas de `desired` cuyo valor difiere de la fila existente"""
+    return {
+        column: value for column, value in desired.items()
+        if normalize_column(column, existing.get(column)) != normalize_column(column, value)
+    }
+
+async def update_client_subscription(writer: ClientSubscriptionWriter, existing: Dict[str, Any], subscription: Any, customer_email: str):
+    """Encolar solo las columnas que cambiaron de una suscripción existente (nada si no cambió ninguna)"""
+    changes = diff_subscription_row(existing, {
+        'billing_customer_id': get_customer_id(subscription),
+        'billing_provider': 'stripe',
+        **subscription_period_data(subscription),
+    })
+    if not changes:
+        writer.skip_unchanged(subscription.id)
+        return
+
+    update_data = {
+        'id': existing['id'],
+        # client_id es NOT NULL: el upsert lo necesita aunque la fila ya exista
+        'client_id': existing['client_id'],
+        **changes,
+        'updated_at': datetime.now().isoformat()
+    }
+    await writer.add(update_data, 'updated', subscription.id, customer_email)
 
 async def get_organization_by_owner_id(owner_id: str) -> Optional[Dict[str, Any]]:
     """Obtener organización por owner_id"""
     try:
-        response = supabase.table('organizations').select(
+        response = await execute(supabase.table('organizations').select(
             'id, name, owner_id'
-        ).eq('owner_id', owner_id).single().execute()
+        ).eq('owner_id', owner_id).single())
         
         if response.data:
             return response.data
@@ -214,11 +452,18 @@ async def get_organization_by_owner_id(owner_id: str) -> Optional[Dict[str, Any]
     
     return None
 
-async def process_agency_subscriptions(billing_account: Dict[str, Any]):
-    """Procesar suscripciones de una agencia"""
+async def process_agency_subscriptions(billing_account: Dict[str, Any], batch_size: int = WRITE_BATCH_SIZE,
+                                       journal: Optional[CheckpointJournal] = None,
+                                       sync_state: Optional[SyncState] = None, incremental: bool = False,
+                                       since: Optional[int] = None, dry_run: bool = False):
+    """Procesar suscripciones de una agencia (completas o, en modo incremental, las cambiadas desde la marca)"""
     provider_id = billing_account['provider_id']
     account_id = billing_account['account_id']
     
+    if journal and journal.is_done('agency', provider_id):
+        stats['skipped_agencies'] += 1
+        return
+    
     # Buscar la organización usando el account_id como owner_id
     organization = await get_organization_by_owner_id(account_id)
     
@@ -231,14 +476,56 @@ async def process_agency_subscriptions(billing_account: Dict[str, Any]):
     
     log_info(f"Procesando agencia: {agency_name} (ID: {agency_id})")
     
-    # Obtener suscripciones de Stripe
-    subscriptions = await get_stripe_subscriptions(provider_id)
+    # Obtener suscripciones de Stripe: las modificadas desde la marca, o todas
+    mark = None
+    if incremental:
+        mark = {'created': since, 'event_ids': []} if since is not None else sync_state.mark(provider_id)
+        if mark and mark['created'] < time.time() - EVENT_RETENTION_SECONDS:
+            log_warning(f"La marca de {agency_name} supera la retención de eventos de Stripe, escaneo completo")
+            mark = None
+
+    if mark:
+        subscriptions, new_mark = await get_changed_subscriptions(provider_id, mark)
+        stats['incremental_agencies'] += 1
+    else:
+        # Los eventos que lleguen durante el escaneo se aplican en la siguiente ejecución incremental
+        new_mark = {'created': int(time.time()), 'event_ids': []}
+        subscriptions = await get_stripe_subscriptions(provider_id)
+        if subscriptions is None:
+            return
+        stats['full_scan_agencies'] += 1
+
+    def advance_mark():
+        if sync_state is not None and not dry_run:
+            sync_state.advance(provider_id, new_mark['created'], new_mark['event_ids'])
+            sync_state.save()
+    
+    if journal:
+        # Descartar las suscripciones ya guardadas en una ejecución anterior
+        pending_subscriptions = [s for s in subscriptions if not journal.is_done('subscription', s.id)]
+        stats['skipped_subscriptions'] += len(subscriptions) - len(pending_subscriptions)
+        subscriptions = pending_subscriptions
     
     if not subscriptions:
         log_warning(f"No hay suscripciones para procesar en agencia {agency_name}")
+        if journal:
+            journal.mark_done('agency', provider_id)
+        advance_mark()
         return
     
-    success_count = 0
+    # Precargar clientes y suscripciones existentes para cruzar en memoria
+    try:
+        index = await prefetch_agency_index(
+            agency_id, [get_customer_id(subscription) for subscription in subscriptions]
+        )
+    except Exception as e:
+        log_error(f"Error precargando clientes de la agencia {agency_name}: {str(e)}")
+        return
+    
+    clients_by_email = index['clients_by_email']
+    subscriptions_by_customer = index['subscriptions_by_customer']
+    writer = ClientSubscriptionWriter(agency_name, batch_size, journal, provider_id, dry_run)
+    processing_errors = 0
     
     # Procesar cada suscripción con barra de progreso
     with tqdm(total=len(subscriptions), desc=f"Procesando {agency_name}", 
@@ -247,11 +534,22 @@ async def process_agency_subscriptions(billing_account: Dict[str, Any]):
         for subscription in subscriptions:
             try:
                 # Obtener email del customer
-                customer_email = await get_customer_email(subscription.customer, provider_id)
+                customer_email = get_customer_email(subscription)
+
+                if subscription.status not in SYNC_STATUSES:
+                    # Solo llega en modo incremental (p. ej. cancelada): se actualiza la fila que
+                    # ya la reflejaba, pero nunca se crea una fila para una suscripción inactiva
+                    existing_subscription = subscriptions_by_customer.get(get_customer_id(subscription))
+                    if existing_subscription and existing_subscription.get('billing_subscription_id') == subscription.id:
+                        await update_client_subscription(writer, existing_subscription, subscription, customer_email or '')
+                    else:
+                        stats['skipped_inactive'] += 1
+                    pbar.update(1)
+                    continue
                 
                 if not customer_email:
                     stats['missing_emails'].append({
-                        'customer_id': subscription.customer,
+                        'customer_id': get_customer_id(subscription),
                         'subscription_id': subscription.id,
                         'agency': agency_name,
                         'agency_id': agency_id,
@@ -261,11 +559,11 @@ async def process_agency_subscriptions(billing_account: Dict[str, Any]):
                     continue
                 
                 # Buscar cliente en nuestra base de datos
-                client = await find_client_by_email(customer_email, agency_id)
+                client = clients_by_email.get(customer_email)
                 
                 if not client:
                     stats['missing_emails'].append({
-                        'customer_id': subscription.customer,
+                        'customer_id': get_customer_id(subscription),
                         'subscription_id': subscription.id,
                         'email': customer_email,
                         'agency': agency_name,
@@ -279,37 +577,73 @@ async def process_agency_subscriptions(billing_account: Dict[str, Any]):
                     continue
                 
                 # Verificar si ya existe la suscripción
-                existing_subscription_id = await check_existing_subscription(subscription.customer)
+                existing_subscription = subscriptions_by_customer.get(get_customer_id(subscription))
 
-                if existing_subscription_id:
+                if existing_subscription:
                     # Actualizar suscripción existente
-                    success = await update_client_subscription(existing_subscription_id, subscription, customer_email)
+                    await update_client_subscription(writer, existing_subscription, subscription, customer_email)
                 else:
-                    # Crear nueva suscripción
-                    success = await create_client_subscription(client['id'], subscription, customer_email)
-                
-                if success:
-                    success_count += 1
-                    stats['successful_syncs'] += 1
-                else:
-                    stats['failed_syncs'] += 1
+                    # Crear nueva suscripción y registrarla para otras suscripciones del mismo customer
+                    subscriptions_by_customer[get_customer_id(subscription)] = await create_client_subscription(
+                        writer, client['id'], subscription, customer_email
+                    )
                 
             except Exception as e:
                 log_error(f"Error procesando suscripción {subscription.id}: {str(e)}")
                 stats['failed_syncs'] += 1
+                processing_errors += 1
             
             pbar.update(1)
     
+    # Guardar las filas pendientes del último lote
+    await writer.flush()
+    success_count = writer.succeeded + writer.changes['unchanged']
+    
     log_success(f"Agencia {agency_name} procesada: {success_count}/{len(subscriptions)} exitosas")
+    log_info(f"Cambios {'previstos ' if dry_run else ''}en {agency_name}: {writer.summary()}")
     stats['processed_agencies'] += 1
+    if writer.failed or processing_errors:
+        # Sin marcar la agencia: --resume reintenta solo las suscripciones que no quedaron guardadas
+        log_warning(f"La agencia {agency_name} queda pendiente y su marca de agua no avanza: hay suscripciones sin guardar")
+    else:
+        if journal:
+            journal.mark_done('agency', provider_id)
+        advance_mark()
+    if journal:
+        journal.sync()
+
+async def generate_fallback_report(metrics_format: Optional[str] = None, wall_seconds: Optional[float] = None):
+    """Generar reporte de emails faltantes, de escrituras fallidas y (opcional) de métricas de peticiones"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    if metrics_format in ('json', 'both'):
+        metrics_filename = f"request_metrics_{timestamp}.json"
+        try:
+            instrumentation.write_json(metrics_filename, {'wall_seconds': wall_seconds, 'stripe_throttle': dict(stripe_throttle.stats)})
+            log_info(f"Métricas de peticiones exportadas: {metrics_filename}")
+        except Exception as e:
+            log_error(f"Error exportando métricas: {str(e)}")
+    if metrics_format in ('prometheus', 'both'):
+        metrics_filename = f"request_metrics_{timestamp}.prom"
+        try:
+            instrumentation.write_prometheus(metrics_filename)
+            log_info(f"Métricas de peticiones exportadas: {metrics_filename}")
+        except Exception as e:
+            log_error(f"Error exportando métricas: {str(e)}")
+
+    if stats['failed_writes']:
+        failed_filename = f"failed_writes_report_{timestamp}.json"
+        try:
+            with open(failed_filename, 'w', encoding='utf-8') as f:
+                json.dump(stats['failed_writes'], f, indent=2, ensure_ascii=False)
+            log_warning(f"Reporte de escrituras fallidas generado: {failed_filename}")
+        except Exception as e:
+            log_error(f"Error generando reporte de escrituras fallidas: {str(e)}")
 
-async def generate_fallback_report():
-    """Generar reporte de emails faltantes"""
     if not stats['missing_emails']:
         log_success("No hay emails faltantes para reportar")
         return
     
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"missing_emails_report_{timestamp}.json"
     
     try:
@@ -322,9 +656,102 @@ async def generate_fallback_report():
     except Exception as e:
         log_error(f"Error generando reporte: {str(e)}")
 
-async def main():
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Migrar suscripciones de Stripe a client_subscriptions")
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=AGENCY_CONCURRENCY,
+        help=f"Número de agencias procesadas en paralelo (por defecto: {AGENCY_CONCURRENCY})"
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=WRITE_BATCH_SIZE,
+        help=f"Filas de client_subscriptions por upsert (por defecto: {WRITE_BATCH_SIZE})"
+    )
+    parser.add_argument(
+        '--io-concurrency',
+        type=int,
+        default=async_io.IO_CONCURRENCY,
+        help=f"Llamadas simultáneas a Supabase/Stripe (por defecto: {async_io.IO_CONCURRENCY})"
+    )
+    parser.add_argument(
+        '--stripe-rps',
+        type=float,
+        default=stripe_throttle.STRIPE_MAX_RPS,
+        help=f"Peticiones por segundo a Stripe entre todas las agencias (por defecto: {stripe_throttle.STRIPE_MAX_RPS:g})"
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help="Reanudar desde el diario de checkpoint, saltando agencias y suscripciones ya procesadas"
+    )
+    parser.add_argument(
+        '--checkpoint',
+        default=CHECKPOINT_FILE,
+        help=f"Ruta del diario de checkpoint (por defecto: {CHECKPOINT_FILE})"
+    )
+    parser.add_argument(
+        '--since',
+        nargs='?',
+        const='state',
+        help="Modo incremental: solo las suscripciones con eventos customer.subscription.* desde la "
+             "marca guardada de cada cuenta, o desde esta fecha ISO / timestamp Unix"
+    )
+    parser.add_argument(
+        '--state-file',
+        default=SYNC_STATE_FILE,
+        help=f"Archivo con la marca de agua por cuenta conectada (por defecto: {SYNC_STATE_FILE})"
+    )
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default='postgrest',
+        help="Escribir client_subscriptions vía PostgREST o directo a Postgres (DATABASE_URL)"
+    )
+    parser.add_argument(
+        '--metrics',
+        choices=['json', 'prometheus', 'both'],
+        help="Exportar las métricas por endpoint junto a los reportes (JSON y/o texto de Prometheus)"
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help="Calcular los cambios y mostrar un resumen por agencia sin escribir en la base de datos"
+    )
+    args = parser.parse_args()
+    if args.dry_run and args.resume:
+        parser.error("--dry-run no usa el diario de checkpoint, no se puede combinar con --resume")
+    return args
+
+async def main(args: argparse.Namespace):
     print(f"{BLUE}🚀 Iniciando migración de suscripciones de Stripe{RESET}")
     print(f"{BLUE}{'='*60}{RESET}")
+    started_at = time.perf_counter()
+    
+    instrumentation.enable()
+    async_io.configure(args.io_concurrency)
+    stripe_throttle.configure(max_rps=args.stripe_rps)
+    
+    global pg_writer
+    if args.dry_run:
+        log_warning("Modo --dry-run: no se escribe en la base de datos, ni en el checkpoint ni en la marca de agua")
+    elif args.backend == 'postgres':
+        pg_writer = PostgresWriter(max_connections=args.io_concurrency)
+        log_info(f"Escribiendo directo a Postgres ({pg_writer.dsn.rsplit('@', 1)[-1]})")
+
+    journal = None if args.dry_run else CheckpointJournal(args.checkpoint, resume=args.resume)
+    # Toda ejecución deja la marca de agua de cada cuenta, para que la siguiente pueda ser incremental
+    sync_state = SyncState(args.state_file)
+    incremental = args.since is not None
+    since = parse_since(args.since) if incremental else None
+    if incremental:
+        origin = 'la marca guardada' if since is None else datetime.fromtimestamp(since, timezone.utc).isoformat()
+        log_info(f"Modo incremental desde {origin} ({len(sync_state.accounts)} cuentas con marca en {args.state_file})")
+    if args.resume:
+        log_info(f"Reanudando desde {args.checkpoint}: {journal.count('agency')} agencias y "
+                 f"{journal.count('subscription')} suscripciones ya procesadas")
     
     # Obtener billing accounts de Stripe
     billing_accounts = await get_billing_accounts_stripe()
@@ -333,15 +760,32 @@ async def main():
         log_error("No hay cuentas de Stripe para procesar")
         return
     
-    log_info(f"Iniciando procesamiento de {len(billing_accounts)} agencias")
+    log_info(f"Iniciando procesamiento de {len(billing_accounts)} agencias (concurrencia: {args.concurrency})")
     
-    # Procesar cada agencia
-    for billing_account in billing_accounts:
-        await process_agency_subscriptions(billing_account)
-        print()  # Espacio entre agencias
+    # Procesar varias agencias a la vez, limitadas por un semáforo
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+
+    async def process_with_limit(billing_account: Dict[str, Any]):
+        async with semaphore:
+            try:
+                await process_agency_subscriptions(billing_account, args.batch_size, journal,
+                                                   sync_state, incremental, since, args.dry_run)
+            except Exception as e:
+                log_error(f"Error procesando agencia {billing_account.get('account_id')}: {str(e)}")
+            print()  # Espacio entre agencias
+
+    try:
+        await asyncio.gather(*[process_with_limit(billing_account) for billing_account in billing_accounts])
+    finally:
+        if journal:
+            journal.close()
+        if pg_writer is not None:
+            pg_writer.close()
     
+    wall_seconds = time.perf_counter() - started_at
+
     # Generar reporte de fallback
-    await generate_fallback_report()
+    await generate_fallback_report(args.metrics, wall_seconds)
     
     # Mostrar estadísticas finales
     print(f"{BLUE}{'='*60}{RESET}")
@@ -351,13 +795,29 @@ async def main():
     print(f"{GREEN}✓ Sincronizaciones exitosas: {stats['successful_syncs']}{RESET}")
     print(f"{GREEN}✓ Suscripciones creadas: {stats['created_subscriptions']}{RESET}")
     print(f"{GREEN}✓ Suscripciones actualizadas: {stats['updated_subscriptions']}{RESET}")
+    print(f"{GREEN}✓ Suscripciones sin cambios (no se escriben): {stats['unchanged_subscriptions']}{RESET}")
     print(f"{RED}✗ Sincronizaciones fallidas: {stats['failed_syncs']}{RESET}")
     print(f"{YELLOW}⚠ Emails faltantes: {len(stats['missing_emails'])}{RESET}")
+    print(f"{YELLOW}⚠ Respuestas 429 de Stripe: {stripe_throttle.stats['rate_limited']} "
+          f"(reintentos: {stripe_throttle.stats['retries']}, concurrencia final: {stripe_throttle.current_concurrency()}){RESET}")
+    if incremental:
+        print(f"{BLUE}ℹ Agencias incrementales: {stats['incremental_agencies']}, "
+              f"con escaneo completo: {stats['full_scan_agencies']}{RESET}")
+        print(f"{BLUE}ℹ Suscripciones inactivas sin fila que actualizar: {stats['skipped_inactive']}{RESET}")
+    if args.resume:
+        print(f"{BLUE}ℹ Agencias saltadas (checkpoint): {stats['skipped_agencies']}{RESET}")
+        print(f"{BLUE}ℹ Suscripciones saltadas (checkpoint): {stats['skipped_subscriptions']}{RESET}")
     
+    # Tiempo por endpoint: permite ver si se va en Stripe, en Supabase o en trabajo local
+    instrumentation.print_summary(wall_seconds)
+
     if stats['missing_emails']:
         print(f"{YELLOW}⚠ Revisa el archivo de reporte para procesar manualmente los casos faltantes{RESET}")
     
-    print(f"{GREEN}🎉 Migración completada exitosamente{RESET}")
+    if args.dry_run:
+        print(f"{YELLOW}⚠ Simulación (--dry-run): las creaciones y actualizaciones anteriores no se guardaron{RESET}")
+    else:
+        print(f"{GREEN}🎉 Migración completada exitosamente{RESET}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(parse_args()))
\ No newline at end of file
@@ -0,0 +1,48 @@
+"""AES-256-GCM credentials format shared by the account_plugins migrations (see apps/web/app/utils/credentials-crypto.ts)."""
+import json
+import os
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+class CredentialsEncryptor:
+    def __init__(self, secret_key):
+        self.secret_key = bytes.fromhex(secret_key)
+        if len(self.secret_key) != 32:
+            raise ValueError("Secret key must be 32 bytes for AES-256")
+        
+        self.aesgcm = AESGCM(self.secret_key)
+
+    def encrypt(self, data, version=1):
+        iv = os.urandom(16)
+        
+        json_data = json.dumps(data).encode('utf-8')
+        
+        encrypted = self.aesgcm.encrypt(iv, json_data, None)
+        
+        return {
+            'data': encrypted[:-16].hex(),  
+            'iv': iv.hex(),
+            'version': version,
+            'tag': encrypted[-16:].hex() 
+        }
+
+
+class CredentialsDecryptor:
+    def __init__(self, secret_key):
+        self.secret_key = bytes.fromhex(secret_key)
+        if len(self.secret_key) != 32:
+            raise ValueError("Secret key must be 32 bytes for AES-256")
+        
+        self.aesgcm = AESGCM(self.secret_key)
+
+    def decrypt(self, encrypted_data):
+        data = bytes.fromhex(encrypted_data['data'])
+        iv = bytes.fromhex(encrypted_data['iv'])
+        tag = bytes.fromhex(encrypted_data['tag'])
+        
+        ciphertext = data + tag
+        
+        decrypted = self.aesgcm.decrypt(iv, ciphertext, None)
+        
+        return json.loads(decrypted.decode('utf-8'))
@@ -1,28 +1,10 @@
 import os
 import json
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from dotenv import load_dotenv
 
-load_dotenv()
-
-class CredentialsDecryptor:
-    def __init__(self, secret_key):
-        self.secret_key = bytes.fromhex(secret_key)
-        if len(self.secret_key) != 32:
-            raise ValueError("Secret key must be 32 bytes for AES-256")
-        
-        self.aesgcm = AESGCM(self.secret_key)
+from credentials import CredentialsDecryptor
 
-    def decrypt(self, encrypted_data):
-        data = bytes.fromhex(encrypted_data['data'])
-        iv = bytes.fromhex(encrypted_data['iv'])
-        tag = bytes.fromhex(encrypted_data['tag'])
-        
-        ciphertext = data + tag
-        
-        decrypted = self.aesgcm.decrypt(iv, ciphertext, None)
-        
-        return json.loads(decrypted.decode('utf-8'))
+load_dotenv()
 
 def main():
     encryption_key = os.getenv('ENCRYPTION_KEY')
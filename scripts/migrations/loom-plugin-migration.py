@@ -1,94 +1,125 @@
 import os
+import sys
+import argparse
+import csv
 import json
-from datetime import datetime
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-import base64
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 import uuid
 
+from credentials import CredentialsEncryptor
+
+# Módulos compartidos en scripts/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from async_io import chunked
+from sql_emitter import SqlEmitter
+
 load_dotenv()
 
-class CredentialsEncryptor:
-    def __init__(self, secret_key):
-        self.secret_key = bytes.fromhex(secret_key)
-        if len(self.secret_key) != 32:
-            raise ValueError("Secret key must be 32 bytes for AES-256")
-        
-        self.aesgcm = AESGCM(self.secret_key)
-
-    def encrypt(self, data):
-        iv = os.urandom(16)
-        
-        json_data = json.dumps(data).encode('utf-8')
-        
-        encrypted = self.aesgcm.encrypt(iv, json_data, None)
-        
-        return {
-            'data': encrypted[:-16].hex(),  
-            'iv': iv.hex(),
-            'version': 1,
-            'tag': encrypted[-16:].hex() 
-        }
+# YOUR plugin_id
+LOOM_PLUGIN_ID = 'c9a95821-6d63-4588-98b1-47d4aaaa46be'
+OUTPUT_FILE = 'loom-plugin.sql'
+# Providers por tarea del pool y filas por cada INSERT multi-fila
+CHUNK_SIZE = 500
+ROWS_PER_INSERT = 500
+
+# created_at/updated_at toman NOW() y deleted_on NULL por defecto en la tabla
+ACCOUNT_PLUGIN_COLUMNS = ['plugin_id', 'account_id', 'status', 'credentials', 'provider_id']
+
+def read_providers(path):
+    """Leer providers en streaming desde un CSV (con cabecera) o un JSONL"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+_worker_encryptor = None
+
+def _init_worker(encryption_key):
+    global _worker_encryptor
+    _worker_encryptor = CredentialsEncryptor(encryption_key)
+
+def _encrypt_chunk(providers):
+    return [
+        (provider, _worker_encryptor.encrypt({'loom_app_id': provider['account_id']}))
+        for provider in providers
+    ]
+
+def encrypt_providers(providers, encryption_key, workers, chunk_size=CHUNK_SIZE):
+    """Cifrar providers por bloques en un pool de procesos, en orden y con `workers * 2` bloques en vuelo como máximo."""
+    chunks = chunked(providers, chunk_size)
+    if workers <= 1:
+        _init_worker(encryption_key)
+        for chunk in chunks:
+            yield from _encrypt_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(encryption_key,)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_encrypt_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def write_inserts(rows, output_file, plugin_id, loom_provider_id, rows_per_insert=ROWS_PER_INSERT, sql_format='values'):
+    """Escribir las filas en streaming con el emisor SQL compartido (INSERT multi-fila o COPY)"""
+    with open(output_file, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+        with SqlEmitter(f, 'account_plugins', ACCOUNT_PLUGIN_COLUMNS, fmt=sql_format,
+                        rows_per_statement=rows_per_insert) as emitter:
+            for provider, encrypted in rows:
+                emitter.add((plugin_id, provider['user_id'], 'installed', encrypted, str(loom_provider_id)))
+    return emitter.rows_written
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generar el SQL de account_plugins con credenciales de Loom cifradas")
+    parser.add_argument('--input', help="CSV o JSONL con account_id, user_id y provider (por defecto, la lista del script)")
+    parser.add_argument('--output', default=OUTPUT_FILE, help=f"Archivo SQL de salida (por defecto: {OUTPUT_FILE})")
+    parser.add_argument('--plugin-id', default=LOOM_PLUGIN_ID, help="plugin_id de Loom")
+    parser.add_argument('--provider-id', help="provider_id de Loom (por defecto, un uuid nuevo)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Procesos para cifrar")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Providers por tarea del pool")
+    parser.add_argument('--rows-per-insert', type=int, default=ROWS_PER_INSERT, help="Filas por INSERT")
+    parser.add_argument('--sql-format', choices=['values', 'copy'], default='values',
+                        help="INSERT multi-fila o bloque COPY para psql -f (más rápido de cargar)")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     encryption_key = os.getenv('ENCRYPTION_KEY')
     if not encryption_key:
-        raise ValueError("ENCRYPTION_KEY environment variable is required")\
+        raise ValueError("ENCRYPTION_KEY environment variable is required")
+    # Validar la clave antes de arrancar el pool
+    CredentialsEncryptor(encryption_key)
 
     # YOUR loom provider id
 
-    LOOM_PROVIDER_ID = uuid.uuid4()  
+    LOOM_PROVIDER_ID = args.provider_id or uuid.uuid4()
 
-    providers = [
-        # YOUR provider
-        {
-            'account_id': 'bc5a7eb1-98c9-429d-9b61-eebbca314682',
-            'user_id': 'fd052e52-0223-4079-9f3e-a3056c9e8a57',    
-            'provider': 'loom'
-        }
-    ]
+    if args.input:
+        providers = read_providers(args.input)
+    else:
+        providers = [
+            # YOUR provider
+            {
+                'account_id': 'bc5a7eb1-98c9-429d-9b61-eebbca314682',
+                'user_id': 'fd052e52-0223-4079-9f3e-a3056c9e8a57',    
+                'provider': 'loom'
+            }
+        ]
+
+    encrypted_rows = encrypt_providers(providers, encryption_key, args.workers, args.chunk_size)
+    written = write_inserts(encrypted_rows, args.output, args.plugin_id, LOOM_PROVIDER_ID,
+                            args.rows_per_insert, args.sql_format)
 
-    encryptor = CredentialsEncryptor(encryption_key)
-    sql_content = ''
-
-    for provider in providers:
-        # YOUR plugin_id
-        plugin_id = 'c9a95821-6d63-4588-98b1-47d4aaaa46be',
-        
-        credentials = {
-            'loom_app_id': provider['account_id'],
-        }
-
-
-        encrypted = encryptor.encrypt(credentials)
-
-        sql_insert = f"""INSERT INTO account_plugins (
-    plugin_id,
-    account_id,
-    status,
-    credentials,
-    created_at,
-    updated_at,
-    deleted_on,
-    provider_id
-) VALUES (
-    {plugin_id},
-    '{provider['user_id']}',
-    'installed',
-    '{json.dumps(encrypted)}',
-    NOW(),
-    NOW(),
-    NULL,
-    '{LOOM_PROVIDER_ID}'
-);\n\n"""
-
-        sql_content += sql_insert
-
-    # Guardar en archivo
-    with open('loom-plugin.sql', 'w') as f:
-        f.write(sql_content)
-    
-    print('SQL file generated successfully!')
+    print(f'SQL file generated successfully! ({written} rows in {args.output})')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from supabase import Client
+
+from credentials import CredentialsDecryptor, CredentialsEncryptor
+
+# Shared helpers live in scripts/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import async_io
+from async_io import chunked, execute, write_with_row_fallback
+from clients import supabase_client
+from checkpoint import CheckpointJournal
+from supabase_paging import iter_pages
+
+load_dotenv()
+
+SUPABASE_URL = "your_supabase_url"
+SUPABASE_SERVICE_ROLE_KEY = "your_supabase_service_role_key"
+
+PAGE_SIZE = 1000
+# Rows per worker task and per upsert request
+CHUNK_SIZE = 250
+UPSERT_BATCH_SIZE = 500
+CHECKPOINT_FILE = 'rotate_credentials_key.checkpoint.jsonl'
+
+# Columns sent back on upsert: the NOT NULL ones are required even when the row exists
+UPSERT_COLUMNS = 'id, plugin_id, account_id, provider_id, credentials'
+
+supabase: Client = supabase_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+stats = {
+    'rotated': 0,
+    'already_rotated': 0,
+    'skipped': 0,
+    'failed': 0,
+    'failed_writes': 0
+}
+
+_decryptor = None
+_new_decryptor = None
+_encryptor = None
+
+
+def _init_worker(old_key, new_key):
+    global _decryptor, _new_decryptor, _encryptor
+    _decryptor = CredentialsDecryptor(old_key)
+    _new_decryptor = CredentialsDecryptor(new_key)
+    _encryptor = CredentialsEncryptor(new_key)
+
+
+def parse_credentials(raw):
+    """account_plugins.credentials holds either the object or a JSON string of it"""
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return None
+    if isinstance(raw, dict) and all(key in raw for key in ('data', 'iv', 'tag')):
+        return raw
+    return None
+
+
+def rotate_row(row, version=None):
+    """Re-encrypt one row with the new key. Returns (status, new credentials or None)."""
+    encrypted = parse_credentials(row.get('credentials'))
+    if encrypted is None:
+        return 'skipped', None
+
+    try:
+        data = _decryptor.decrypt(encrypted)
+    except Exception:
+        # A row written by an interrupted run is already under the new key
+        try:
+            _new_decryptor.decrypt(encrypted)
+            return 'already_rotated', None
+        except Exception:
+            return 'failed', None
+
+    rotated = _encryptor.encrypt(data, version or int(encrypted.get('version') or 1) + 1)
+    # Keep the stored shape (the web app writes a JSON string)
+    if isinstance(row['credentials'], str):
+        rotated = json.dumps(rotated)
+    return 'rotated', rotated
+
+
+def _rotate_chunk(rows, version=None):
+    results = []
+    for row in rows:
+        status, credentials = rotate_row(row, version)
+        results.append((row, status, credentials))
+    return results
+
+
+async def upsert_credentials(rows):
+    """Write a batch of rotated rows, retrying one by one if the batch fails. Returns the written ids."""
+    def report_failure(row, error):
+        print(f"Error writing account_plugins {row['id']}: {error}")
+        stats['failed_writes'] += 1
+
+    written = await write_with_row_fallback(
+        lambda batch: execute(supabase.table('account_plugins').upsert(batch, on_conflict='id', default_to_null=False)),
+        rows, report_failure,
+        lambda batch, error: print(f"Batch of {len(batch)} rows failed ({error}), retrying one by one")
+    )
+    return [row['id'] for row in written]
+
+
+async def rotate_page(page, pool, journal, args):
+    loop = asyncio.get_running_loop()
+    pending = [row for row in page if not (journal and journal.is_done('account_plugin', row['id']))]
+    if not pending:
+        return
+
+    chunk_results = await asyncio.gather(*[
+        loop.run_in_executor(pool, _rotate_chunk, chunk, args.version)
+        for chunk in chunked(pending, args.chunk_size)
+    ])
+
+    updates = []
+    for results in chunk_results:
+        for row, status, credentials in results:
+            stats[status] += 1
+            if status == 'rotated':
+                updates.append({**row, 'credentials': credentials})
+            elif status == 'failed':
+                print(f"Could not decrypt account_plugins {row['id']} with either key")
+
+    if args.dry_run:
+        return
+
+    written = await asyncio.gather(*[upsert_credentials(batch) for batch in chunked(updates, args.batch_size)])
+    for ids in written:
+        journal.mark_many_done('account_plugin', ids)
+    journal.sync()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Re-encrypt account_plugins.credentials from OLD_ENCRYPTION_KEY to NEW_ENCRYPTION_KEY"
+    )
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Processes used to decrypt/encrypt")
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help="Rows read per page")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows per worker task")
+    parser.add_argument('--batch-size', type=int, default=UPSERT_BATCH_SIZE, help="Rows per upsert")
+    parser.add_argument('--version', type=int, help="Version to store (default: current version + 1)")
+    parser.add_argument('--plugin-id', help="Only rotate the credentials of this plugin")
+    parser.add_argument('--dry-run', action='store_true', help="Decrypt and re-encrypt without writing")
+    parser.add_argument('--resume', action='store_true', help="Skip rows recorded in the checkpoint")
+    parser.add_argument('--checkpoint', default=CHECKPOINT_FILE, help="Checkpoint journal path")
+    args = parser.parse_args()
+    if args.dry_run and args.resume:
+        parser.error("--dry-run does not use the checkpoint journal and cannot be combined with --resume")
+    return args
+
+
+async def main(args):
+    old_key = os.getenv('OLD_ENCRYPTION_KEY')
+    new_key = os.getenv('NEW_ENCRYPTION_KEY')
+    if not old_key or not new_key:
+        raise ValueError("OLD_ENCRYPTION_KEY and NEW_ENCRYPTION_KEY environment variables are required")
+    # Fail on a malformed key before starting the pool
+    CredentialsDecryptor(old_key)
+    CredentialsEncryptor(new_key)
+
+    def build_query():
+        query = supabase.table('account_plugins').select(UPSERT_COLUMNS).not_.is_('credentials', 'null')
+        if args.plugin_id:
+            query = query.eq('plugin_id', args.plugin_id)
+        return query
+
+    # A dry run never opens the journal: opening it without --resume would truncate the
+    # checkpoint of an interrupted rotation
+    journal = None if args.dry_run else CheckpointJournal(args.checkpoint, resume=args.resume)
+    if args.resume:
+        print(f"Resuming: {journal.count('account_plugin')} rows already rotated")
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_worker,
+                                 initargs=(old_key, new_key)) as pool:
+            async for page in iter_pages(build_query, args.page_size):
+                await rotate_page(page, pool, journal, args)
+                print(f"Rotated {stats['rotated']} rows so far")
+    finally:
+        if journal:
+            journal.close()
+        async_io.shutdown()
+
+    print("\nKey rotation summary")
+    print(f"Rotated: {stats['rotated']}{' (dry run, nothing written)' if args.dry_run else ''}")
+    print(f"Already under the new key: {stats['already_rotated']}")
+    print(f"Skipped (no encrypted credentials): {stats['skipped']}")
+    print(f"Failed to decrypt: {stats['failed']}")
+    print(f"Failed writes: {stats['failed_writes']}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
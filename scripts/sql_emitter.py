@@ -0,0 +1,180 @@
+"""Streaming SQL file emitter: chunked INSERT ... VALUES statements ('values') or COPY blocks for psql ('copy').
+
+Updates and inserts with on_conflict go through a temp table typed like the target.
+"""
+import json
+import math
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence, TextIO, Union
+
+ROWS_PER_STATEMENT = 500
+FORMATS = ('values', 'copy')
+OPERATIONS = ('insert', 'update')
+
+
+def _check_finite(value: float):
+    if not math.isfinite(value):
+        raise ValueError(f"Cannot write non-finite number {value!r} as SQL")
+
+
+def sql_literal(value: Any) -> str:
+    """Render a Python value as a PostgreSQL literal (standard_conforming_strings on)."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        if isinstance(value, float):
+            _check_finite(value)
+        return repr(value)
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, allow_nan=False)
+    elif isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def copy_field(value: Any) -> str:
+    """Render a value as a COPY csv field: NULL is an unquoted empty field, everything else is quoted."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        value = 't' if value else 'f'
+    elif isinstance(value, float):
+        _check_finite(value)
+        value = repr(value)
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value, allow_nan=False)
+    elif isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def quote_identifier(name: str) -> str:
+    return name if name.isidentifier() and name.islower() else '"' + name.replace('"', '""') + '"'
+
+
+class SqlEmitter:
+    def __init__(self, file: TextIO, table: str, columns: Sequence[str], fmt: str = 'values',
+                 operation: str = 'insert', key: Optional[str] = None,
+                 rows_per_statement: int = ROWS_PER_STATEMENT, on_conflict: Optional[str] = None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown SQL format {fmt!r} (expected one of {FORMATS})")
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown SQL operation {operation!r} (expected one of {OPERATIONS})")
+        if operation == 'update' and key not in columns:
+            raise ValueError("Updates need a key column that is part of the columns")
+
+        self.file = file
+        self.table = table
+        self.columns = list(columns)
+        self.fmt = fmt
+        self.operation = operation
+        self.key = key
+        self.rows_per_statement = max(1, rows_per_statement)
+        self.on_conflict = on_conflict
+        self.rows_written = 0
+        self._pending: List[str] = []
+        self._copy_started = False
+        self._temp_table_created = False
+        self._column_list = ", ".join(quote_identifier(column) for column in self.columns)
+        self._temp_table = f"_{table.rsplit('.', 1)[-1]}_{operation}_rows"
+
+    def __enter__(self) -> 'SqlEmitter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _values(self, row: Union[Dict[str, Any], Sequence[Any]]) -> List[Any]:
+        if isinstance(row, dict):
+            return [row.get(column) for column in self.columns]
+        if len(row) != len(self.columns):
+            raise ValueError(f"Expected {len(self.columns)} values, got {len(row)}")
+        return list(row)
+
+    def add(self, row: Union[Dict[str, Any], Sequence[Any]]):
+        values = self._values(row)
+        if self.fmt == 'copy':
+            self._start_copy()
+            self.file.write(",".join(copy_field(value) for value in values) + "\n")
+            self.rows_written += 1
+            return
+
+        self._pending.append("(" + ", ".join(sql_literal(value) for value in values) + ")")
+        if len(self._pending) >= self.rows_per_statement:
+            self._write_statement()
+
+    def add_many(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def _assignments(self, source: str) -> str:
+        return ", ".join(f"{quote_identifier(column)} = {source}.{quote_identifier(column)}"
+                         for column in self.columns if column != self.key)
+
+    def _write_statement(self):
+        if not self._pending:
+            return
+        values = ",\n".join(self._pending)
+        if self.operation == 'insert':
+            conflict = f"\nON CONFLICT ({self.on_conflict}) DO NOTHING" if self.on_conflict else ""
+            self.file.write(f"INSERT INTO {self.table} ({self._column_list}) VALUES\n{values}{conflict};\n\n")
+        else:
+            # A bare (VALUES ...) list would type quoted literals as text (uuid = text fails),
+            # so the rows go through a temp table typed like the target and are applied at close()
+            self._create_temp_table()
+            self.file.write(f"INSERT INTO {self._temp_table} ({self._column_list}) VALUES\n{values};\n\n")
+        self.rows_written += len(self._pending)
+        self._pending = []
+
+    @property
+    def _copies_to_temp_table(self) -> bool:
+        return self.operation == 'update' or bool(self.on_conflict)
+
+    def _create_temp_table(self):
+        if self._temp_table_created:
+            return
+        self._temp_table_created = True
+        # Same column types as the target table, filled by COPY / INSERT and applied at close()
+        self.file.write(
+            f"CREATE TEMP TABLE {self._temp_table} AS\n"
+            f"SELECT {self._column_list} FROM {self.table} WITH NO DATA;\n"
+        )
+
+    def _apply_temp_table(self):
+        if not self._temp_table_created:
+            return
+        if self.operation == 'update':
+            key = quote_identifier(self.key)
+            self.file.write(
+                f"UPDATE {self.table} AS t SET {self._assignments('v')}\n"
+                f"FROM {self._temp_table} AS v\n"
+                f"WHERE t.{key} = v.{key};\n"
+            )
+        else:
+            self.file.write(
+                f"INSERT INTO {self.table} ({self._column_list})\n"
+                f"SELECT {self._column_list} FROM {self._temp_table}\n"
+                f"ON CONFLICT ({self.on_conflict}) DO NOTHING;\n"
+            )
+        self.file.write(f"DROP TABLE {self._temp_table};\n\n")
+        self._temp_table_created = False
+
+    def _start_copy(self):
+        if self._copy_started:
+            return
+        self._copy_started = True
+        target = self.table
+        if self._copies_to_temp_table:
+            self._create_temp_table()
+            target = self._temp_table
+        self.file.write(f"COPY {target} ({self._column_list}) FROM STDIN WITH (FORMAT csv);\n")
+
+    def close(self):
+        if self.fmt == 'values':
+            self._write_statement()
+        elif self._copy_started:
+            self.file.write("\\.\n\n")
+            self._copy_started = False
+        self._apply_temp_table()
@@ -0,0 +1,164 @@
+"""Rate-limit-aware wrapper for Stripe calls: token bucket, adaptive concurrency and retries with backoff."""
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import instrumentation
+
+# Stripe allows 100 read req/s in live mode (25 in test mode); stay below the ceiling
+STRIPE_MAX_RPS = float(os.getenv('STRIPE_MAX_RPS', '50'))
+STRIPE_MAX_CONCURRENCY = int(os.getenv('STRIPE_MAX_CONCURRENCY', '16'))
+STRIPE_MAX_RETRIES = int(os.getenv('STRIPE_MAX_RETRIES', '6'))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+# Clean responses needed before the limiter opens one more slot
+ADDITIVE_INCREASE_EVERY = 20
+
+_stats_lock = threading.Lock()
+stats: Dict[str, int] = {
+    'calls': 0,
+    'retries': 0,
+    'rate_limited': 0,
+    'gave_up': 0
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `acquire` blocks until a token is available."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """Additive-increase / multiplicative-decrease cap on in-flight requests."""
+
+    def __init__(self, max_limit: int, initial: Optional[int] = None, min_limit: int = 1):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = min(self.max_limit, initial or max(min_limit, self.max_limit // 2))
+        self.in_flight = 0
+        self.clean_streak = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.clean_streak = 0
+                self.limit = max(self.min_limit, self.limit // 2)
+            else:
+                self.clean_streak += 1
+                if self.clean_streak >= ADDITIVE_INCREASE_EVERY and self.limit < self.max_limit:
+                    self.clean_streak = 0
+                    self.limit += 1
+            self.condition.notify_all()
+
+
+def _count(key: str):
+    with _stats_lock:
+        stats[key] += 1
+
+
+_bucket = TokenBucket(STRIPE_MAX_RPS)
+_limiter = AdaptiveLimiter(STRIPE_MAX_CONCURRENCY)
+
+
+def configure(max_rps: Optional[float] = None, max_concurrency: Optional[int] = None):
+    """Replace the shared bucket/limiter (call before issuing any request)."""
+    global _bucket, _limiter
+    if max_rps is not None:
+        _bucket = TokenBucket(max_rps)
+    if max_concurrency is not None:
+        _limiter = AdaptiveLimiter(max_concurrency)
+
+
+def current_concurrency() -> int:
+    return _limiter.limit
+
+
+def _header(error: Exception, name: str) -> Optional[str]:
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return headers.get(name) or headers.get(name.lower())
+    except AttributeError:
+        return None
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    return getattr(error, 'http_status', None) == 429 or type(error).__name__ == 'RateLimitError'
+
+
+def _is_retryable(error: Exception) -> bool:
+    should_retry = _header(error, 'Stripe-Should-Retry')
+    if should_retry is not None:
+        return should_retry == 'true'
+    if _is_rate_limited(error) or type(error).__name__ == 'APIConnectionError':
+        return True
+    status = getattr(error, 'http_status', None)
+    return status is not None and status >= 500
+
+
+def _backoff_seconds(error: Exception, attempt: int) -> float:
+    # Full jitter, but never sooner than what Stripe asked for
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+    retry_after = _header(error, 'Retry-After')
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+
+def call_stripe(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Call a Stripe API method with throttling and retries (blocking)."""
+    attempt = 0
+    while True:
+        _bucket.acquire()
+        _limiter.acquire()
+        throttled = False
+        try:
+            _count('calls')
+            if instrumentation.enabled:
+                return instrumentation.observe('stripe', instrumentation.stripe_endpoint(fn), fn, *args, **kwargs)
+            return fn(*args, **kwargs)
+        except Exception as e:
+            throttled = _is_rate_limited(e)
+            if throttled:
+                _count('rate_limited')
+            if not _is_retryable(e) or attempt >= STRIPE_MAX_RETRIES:
+                if attempt:
+                    _count('gave_up')
+                raise
+            error = e
+        finally:
+            _limiter.release(throttled)
+
+        _count('retries')
+        time.sleep(_backoff_seconds(error, attempt))
+        attempt += 1
@@ -0,0 +1,38 @@
+"""Keyset pagination over Supabase (PostgREST) tables, past the max-rows cap and with flat memory."""
+from typing import Any, AsyncIterator, Callable, Dict, List
+
+from async_io import execute
+
+PAGE_SIZE = 1000
+
+
+async def iter_pages(build_query: Callable[[], Any], page_size: int = PAGE_SIZE,
+                     key: str = 'id') -> AsyncIterator[List[Dict[str, Any]]]:
+    last_key = None
+    while True:
+        query = build_query()
+        if last_key is not None:
+            query = query.gt(key, last_key)
+        response = await execute(query.order(key).limit(page_size))
+        rows = response.data or []
+        # Stop on an empty page, not a short one: a max-rows cap below page_size would end the walk early
+        if not rows:
+            return
+        yield rows
+        last_key = rows[-1][key]
+
+
+async def iter_rows(build_query: Callable[[], Any], page_size: int = PAGE_SIZE,
+                    key: str = 'id') -> AsyncIterator[Dict[str, Any]]:
+    async for page in iter_pages(build_query, page_size, key):
+        for row in page:
+            yield row
+
+
+async def fetch_all(build_query: Callable[[], Any], page_size: int = PAGE_SIZE,
+                    key: str = 'id') -> List[Dict[str, Any]]:
+    """Collect every row (for result sets that are known to be bounded, e.g. one agency)."""
+    rows: List[Dict[str, Any]] = []
+    async for page in iter_pages(build_query, page_size, key):
+        rows.extend(page)
+    return rows
@@ -0,0 +1,32 @@
+"""High-water marks for incremental (event based) syncs, one per connected account, saved atomically.
+
+A mark keeps the newest applied event time and the ids applied at that second, so the next run
+lists events with `created >= mark` and skips those ids.
+"""
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+
+class SyncState:
+    def __init__(self, path: str):
+        self.path = path
+        self.accounts: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.accounts = json.load(f).get('accounts', {})
+
+    def mark(self, account: str) -> Optional[Dict[str, Any]]:
+        return self.accounts.get(account)
+
+    def advance(self, account: str, created: int, event_ids: Iterable[str] = ()):
+        self.accounts[account] = {'created': int(created), 'event_ids': sorted(set(event_ids))}
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'accounts': self.accounts, 'updated_at': datetime.now().isoformat()}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
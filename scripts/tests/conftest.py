@@ -0,0 +1,30 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(1, SCRIPTS_DIR)
+
+import clients  # noqa: E402
+
+
+def load_script(filename: str):
+    """Import a hyphenated script as a module, without connecting to Supabase."""
+    clients.set_supabase_factory(lambda url, key: None)
+    try:
+        spec = importlib.util.spec_from_file_location(filename.replace('-', '_')[:-3],
+                                                      os.path.join(SCRIPTS_DIR, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        clients.set_supabase_factory(None)
+    return module
+
+
+@pytest.fixture(scope='session')
+def migrate():
+    pytest.importorskip('stripe')
+    pytest.importorskip('tqdm')
+    return load_script('migrate-stripe-subscriptions.py')
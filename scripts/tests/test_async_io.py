@@ -0,0 +1,42 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from async_io import chunked, write_with_row_fallback  # noqa: E402
+
+
+def test_chunked_splits_lists_and_generators():
+    assert list(chunked([1, 2, 3, 4, 5], 2)) == [[1, 2], [3, 4], [5]]
+    assert list(chunked((i for i in range(4)), 2)) == [[0, 1], [2, 3]]
+    assert list(chunked([], 3)) == []
+
+
+def test_write_with_row_fallback_isolates_the_failing_rows():
+    calls, failures, retries = [], [], []
+
+    async def write(rows):
+        calls.append(list(rows))
+        if 'bad' in rows:
+            raise RuntimeError('rejected')
+
+    written = asyncio.run(write_with_row_fallback(
+        write, ['a', 'bad', 'c'], lambda row, e: failures.append((row, str(e))),
+        lambda rows, e: retries.append(len(rows))
+    ))
+
+    assert written == ['a', 'c']
+    assert failures == [('bad', 'rejected')]
+    assert retries == [3]
+    assert calls == [['a', 'bad', 'c'], ['a'], ['bad'], ['c']]
+
+
+def test_write_with_row_fallback_writes_a_clean_batch_once():
+    calls = []
+
+    async def write(rows):
+        calls.append(rows)
+
+    assert asyncio.run(write_with_row_fallback(write, [1, 2], lambda row, e: None)) == [1, 2]
+    assert calls == [[1, 2]]
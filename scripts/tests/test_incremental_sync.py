@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+from sync_state import SyncState
+
+
+class FakeEvent(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+def event(event_id, created, subscription_id):
+    return FakeEvent(id=event_id, created=created, data={'object': {'id': subscription_id}})
+
+
+@pytest.fixture
+def stripe_events(migrate, monkeypatch):
+    """Serve `events` (newest first) through the module's call_stripe, two per page."""
+    events, calls = [], []
+
+    def fake_call_stripe(fn, **params):
+        assert fn == migrate.stripe.Event.list
+        calls.append(params)
+        listed = [e for e in events if e.created >= params['created']['gte']]
+        if 'starting_after' in params:
+            listed = listed[[e.id for e in listed].index(params['starting_after']) + 1:]
+        return SimpleNamespace(data=listed[:2], has_more=len(listed) > 2)
+
+    monkeypatch.setattr(migrate, 'call_stripe', fake_call_stripe)
+    return events, calls
+
+
+def test_events_after_the_mark_second_advance_it(migrate, stripe_events):
+    events, calls = stripe_events
+    events += [event('evt_4', 130, 'sub_2'), event('evt_3', 120, 'sub_1'), event('evt_2', 120, 'sub_2'),
+               event('evt_1', 100, 'sub_9')]
+
+    ids, mark = migrate.list_changed_subscription_ids('acct_1', {'created': 100, 'event_ids': ['evt_1']})
+
+    assert ids == ['sub_2', 'sub_1']
+    assert mark == {'created': 130, 'event_ids': ['evt_4']}
+    assert [call.get('starting_after') for call in calls] == [None, 'evt_3']
+    assert all(call['stripe_account'] == 'acct_1' for call in calls)
+
+
+def test_events_sharing_the_mark_second_are_neither_lost_nor_reapplied(migrate, stripe_events):
+    events, _ = stripe_events
+    # evt_1 was applied by the previous run; evt_2 arrived later within the same second
+    events += [event('evt_2', 100, 'sub_2'), event('evt_1', 100, 'sub_1')]
+
+    ids, mark = migrate.list_changed_subscription_ids('acct_1', {'created': 100, 'event_ids': ['evt_1']})
+    assert ids == ['sub_2']
+    assert mark['created'] == 100 and sorted(mark['event_ids']) == ['evt_1', 'evt_2']
+
+    ids, next_mark = migrate.list_changed_subscription_ids('acct_1', mark)
+    assert ids == []
+    assert next_mark == mark
+
+
+def test_no_new_events_keep_the_mark(migrate, stripe_events):
+    mark = {'created': 100, 'event_ids': []}
+    assert migrate.list_changed_subscription_ids('acct_1', mark) == ([], mark)
+
+
+def test_sync_state_round_trips_the_mark(tmp_path):
+    path = str(tmp_path / 'sync.state.json')
+    state = SyncState(path)
+    assert state.mark('acct_1') is None
+    state.advance('acct_1', 100, ['evt_2', 'evt_1', 'evt_2'])
+    state.save()
+    assert SyncState(path).mark('acct_1') == {'created': 100, 'event_ids': ['evt_1', 'evt_2']}
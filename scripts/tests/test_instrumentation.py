@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import instrumentation  # noqa: E402
+
+postgrest = pytest.importorskip('postgrest')
+
+
+@pytest.fixture
+def client():
+    return postgrest.SyncPostgrestClient('http://127.0.0.1:54321/rest/v1')
+
+
+def test_supabase_endpoint_uses_method_and_table_of_real_builders(client):
+    assert instrumentation.supabase_endpoint(client.table('tokens').select('id').eq('id', 1)) == 'GET /tokens'
+    assert instrumentation.supabase_endpoint(
+        client.table('services').select('id').eq('id', 1).single()) == 'GET /services'
+    assert instrumentation.supabase_endpoint(
+        client.table('client_subscriptions').upsert({'id': 1}, on_conflict='id')) == 'POST /client_subscriptions'
+    assert instrumentation.supabase_endpoint(
+        client.table('services').update({'checkout_url': 'x'}).eq('id', 1)) == 'PATCH /services'
+
+
+def test_supabase_endpoint_keys_on_table_not_filters(client):
+    first = client.table('tokens').select('id').eq('id', 1)
+    second = client.table('tokens').select('id, access_token').in_('id', [2, 3]).limit(10)
+    assert instrumentation.supabase_endpoint(first) == instrumentation.supabase_endpoint(second)
+
+
+def test_observe_records_real_builder_endpoints(client):
+    instrumentation.reset()
+    query = client.table('tokens').select('id')
+    instrumentation.observe('supabase', instrumentation.supabase_endpoint(query), lambda: [])
+    assert list(instrumentation.snapshot()) == ['supabase GET /tokens']
+    instrumentation.reset()
@@ -0,0 +1,121 @@
+import io
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sql_emitter import SqlEmitter, copy_field, sql_literal  # noqa: E402
+
+
+def emit(rows, **kwargs):
+    f = io.StringIO()
+    with SqlEmitter(f, kwargs.pop('table', 'services'), kwargs.pop('columns', ['id', 'checkout_url']),
+                    **kwargs) as emitter:
+        emitter.add_many(rows)
+    return f.getvalue()
+
+
+def test_sql_literal_escapes_quotes_and_keeps_backslashes_and_newlines():
+    assert sql_literal("it's") == "'it''s'"
+    # standard_conforming_strings: a backslash is not an escape character
+    assert sql_literal('C:\\tmp\\n') == "'C:\\tmp\\n'"
+    assert sql_literal('line 1\nline 2') == "'line 1\nline 2'"
+
+
+def test_sql_literal_renders_null_booleans_numbers_json_and_dates():
+    assert sql_literal(None) == 'NULL'
+    assert sql_literal('') == "''"
+    assert sql_literal(True) == 'TRUE'
+    assert sql_literal(False) == 'FALSE'
+    assert sql_literal(42) == '42'
+    assert sql_literal(-0.5) == '-0.5'
+    assert sql_literal({'name': "O'Brien", 'tags': [1, None]}) == '\'{"name": "O\'\'Brien", "tags": [1, null]}\''
+    assert sql_literal(datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)) == "'2025-01-02T03:04:05+00:00'"
+
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf'), {'ratio': float('nan')}])
+def test_non_finite_numbers_are_rejected(value):
+    with pytest.raises(ValueError):
+        sql_literal(value)
+    with pytest.raises(ValueError):
+        copy_field(value)
+
+
+def test_copy_field_distinguishes_null_from_empty_string():
+    assert copy_field(None) == ''
+    assert copy_field('') == '""'
+
+
+def test_copy_field_quotes_quotes_backslashes_and_newlines():
+    assert copy_field('say "hi"') == '"say ""hi"""'
+    assert copy_field('a\\b') == '"a\\b"'
+    assert copy_field('\\.') == '"\\."'
+    assert copy_field('line 1\nline 2') == '"line 1\nline 2"'
+
+
+def test_copy_field_renders_booleans_numbers_and_json():
+    assert copy_field(True) == '"t"'
+    assert copy_field(False) == '"f"'
+    assert copy_field(1.5) == '"1.5"'
+    assert copy_field({'a': [1, 2]}) == '"{""a"": [1, 2]}"'
+
+
+def test_values_insert_is_chunked_with_on_conflict():
+    sql = emit([(1, 'a'), (2, None), (3, "c'")], rows_per_statement=2, on_conflict='id')
+    assert sql == (
+        "INSERT INTO services (id, checkout_url) VALUES\n(1, 'a'),\n(2, NULL)\nON CONFLICT (id) DO NOTHING;\n\n"
+        "INSERT INTO services (id, checkout_url) VALUES\n(3, 'c''')\nON CONFLICT (id) DO NOTHING;\n\n"
+    )
+
+
+def test_values_update_goes_through_a_temp_table_typed_like_the_target():
+    sql = emit([{'id': 1, 'checkout_url': 'https://x/?a=1'}, {'id': 2, 'checkout_url': None}],
+               operation='update', key='id')
+    assert sql == (
+        "CREATE TEMP TABLE _services_update_rows AS\n"
+        "SELECT id, checkout_url FROM services WITH NO DATA;\n"
+        "INSERT INTO _services_update_rows (id, checkout_url) VALUES\n(1, 'https://x/?a=1'),\n(2, NULL);\n\n"
+        "UPDATE services AS t SET checkout_url = v.checkout_url\n"
+        "FROM _services_update_rows AS v\n"
+        "WHERE t.id = v.id;\n"
+        "DROP TABLE _services_update_rows;\n\n"
+    )
+
+
+def test_copy_insert_writes_csv_rows_into_the_table():
+    sql = emit([(1, ''), (2, None)], fmt='copy')
+    assert sql == 'COPY services (id, checkout_url) FROM STDIN WITH (FORMAT csv);\n"1",""\n"2",\n\\.\n\n'
+
+
+def test_copy_update_fills_a_temp_table_and_applies_it_once():
+    sql = emit([(1, 'a,b'), (2, 'c')], fmt='copy', operation='update', key='id')
+    assert sql == (
+        "CREATE TEMP TABLE _services_update_rows AS\n"
+        "SELECT id, checkout_url FROM services WITH NO DATA;\n"
+        "COPY _services_update_rows (id, checkout_url) FROM STDIN WITH (FORMAT csv);\n"
+        '"1","a,b"\n"2","c"\n\\.\n\n'
+        "UPDATE services AS t SET checkout_url = v.checkout_url\n"
+        "FROM _services_update_rows AS v\n"
+        "WHERE t.id = v.id;\n"
+        "DROP TABLE _services_update_rows;\n\n"
+    )
+
+
+def test_copy_with_on_conflict_inserts_from_the_temp_table():
+    sql = emit([('sub_1', 'active')], table='subscriptions', columns=['id', 'status'], fmt='copy', on_conflict='id')
+    assert sql.startswith("CREATE TEMP TABLE _subscriptions_insert_rows AS\n")
+    assert ("INSERT INTO subscriptions (id, status)\nSELECT id, status FROM _subscriptions_insert_rows\n"
+            "ON CONFLICT (id) DO NOTHING;\nDROP TABLE _subscriptions_insert_rows;\n") in sql
+
+
+def test_identifiers_that_need_quoting_are_quoted():
+    sql = emit([(1, 2)], columns=['id', 'Order'])
+    assert sql.startswith('INSERT INTO services (id, "Order") VALUES\n')
+
+
+def test_rows_with_the_wrong_number_of_values_are_rejected():
+    with pytest.raises(ValueError):
+        emit([(1,)])
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import clients  # noqa: E402
+import stripe_throttle  # noqa: E402
+from fake_backends import FakeBackends, build_dataset  # noqa: E402
+
+pytest.importorskip('stripe')
+
+
+@pytest.fixture
+def rate_limited_stripe(monkeypatch):
+    backend = FakeBackends(build_dataset(agencies=1, subscriptions_per_agency=5), rate_limit_ratio=0.25).start()
+    for name, value in backend.client_env().items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(stripe_throttle, 'BACKOFF_BASE_SECONDS', 0.001)
+    stripe_throttle.configure(max_rps=1000, max_concurrency=8)
+    yield backend, clients.configure_stripe('unused')
+    backend.stop()
+
+
+def test_call_stripe_sees_every_429_and_lowers_the_limit(rate_limited_stripe):
+    backend, stripe = rate_limited_stripe
+    assert stripe.max_network_retries == 0
+    initial_limit = stripe_throttle.current_concurrency()
+    rate_limited = stripe_throttle.stats['rate_limited']
+
+    for _ in range(20):
+        page = stripe_throttle.call_stripe(stripe.Subscription.list, limit=5, stripe_account='acct_fake000000')
+        assert len(page.data) == 5
+
+    assert backend.rate_limited > 0
+    assert stripe_throttle.stats['rate_limited'] - rate_limited == backend.rate_limited
+    assert stripe_throttle.current_concurrency() < initial_limit
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, timezone
+
+
+def test_naive_timestamps_are_compared_as_utc(migrate):
+    naive = '2025-06-01T10:00:00'
+    assert migrate.normalize_column('period_starts_at', naive) == datetime(2025, 6, 1, 10, tzinfo=timezone.utc)
+    assert migrate.normalize_column('period_starts_at', '2025-06-01T10:00:00+00:00') == \
+        migrate.normalize_column('period_starts_at', naive)
+    assert migrate.normalize_column('period_starts_at', '2025-06-01T12:00:00+02:00') == \
+        migrate.normalize_column('period_starts_at', naive)
+
+
+def test_other_columns_are_compared_as_is(migrate):
+    assert migrate.normalize_column('status', '2025-06-01T10:00:00') == '2025-06-01T10:00:00'
+    assert migrate.normalize_column('period_ends_at', None) is None
+
+
+def existing_row():
+    # As PostgREST returns it: timestamptz with offset
+    return {
+        'id': 'row-1', 'client_id': 'client-1', 'billing_subscription_id': 'sub_1',
+        'billing_customer_id': 'cus_1', 'billing_provider': 'stripe',
+        'period_starts_at': '2025-06-01T10:00:00+00:00', 'period_ends_at': '2025-07-01T10:00:00+00:00',
+        'trial_starts_at': None, 'trial_ends_at': None, 'status': 'active', 'active': True,
+    }
+
+
+def test_unchanged_row_gives_an_empty_diff(migrate):
+    desired = {column: existing_row()[column] for column in migrate.DIFF_COLUMNS}
+    # subscription_period_data writes naive isoformat() timestamps
+    desired['period_starts_at'] = '2025-06-01T10:00:00'
+    desired['period_ends_at'] = datetime(2025, 7, 1, 10).isoformat()
+    assert migrate.diff_subscription_row(existing_row(), desired) == {}
+
+
+def test_diff_keeps_only_changed_columns(migrate):
+    desired = {column: existing_row()[column] for column in migrate.DIFF_COLUMNS}
+    desired.update(status='past_due', active=False,
+                   period_ends_at=(datetime(2025, 7, 1, 10) + timedelta(days=30)).isoformat())
+    assert migrate.diff_subscription_row(existing_row(), desired) == {
+        'status': 'past_due', 'active': False, 'period_ends_at': '2025-07-31T10:00:00'}
+
+
+def test_columns_missing_from_the_existing_row_count_as_changed(migrate):
+    row = existing_row()
+    del row['trial_ends_at']
+    assert migrate.diff_subscription_row(row, {'trial_ends_at': '2025-06-15T10:00:00'}) == {
+        'trial_ends_at': '2025-06-15T10:00:00'}
@@ -0,0 +1,65 @@
+"""Shared JWT payload codec for the token scripts (payload segment only, any base64 flavour, orjson when installed)."""
+import binascii
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+try:
+    import orjson
+
+    loads = orjson.loads
+    JSON_BACKEND = 'orjson'
+except ImportError:  # optional dependency
+    loads = json.loads
+    JSON_BACKEND = 'json'
+
+_URLSAFE_TO_STANDARD = bytes.maketrans(b'-_', b'+/')
+_MISSING = object()
+
+
+def decode_segment(segment: Union[str, bytes]) -> bytes:
+    """Decode one base64/base64url JWT segment, fixing the padding."""
+    if isinstance(segment, str):
+        segment = segment.encode('ascii')
+    segment = segment.rstrip(b'=').translate(_URLSAFE_TO_STANDARD)
+    return binascii.a2b_base64(segment + b'=' * (-len(segment) % 4))
+
+
+def payload_segment(token: str) -> str:
+    """Return the payload part of `header.payload.signature` without splitting the rest."""
+    start = token.index('.') + 1
+    end = token.find('.', start)
+    return token[start:] if end == -1 else token[start:end]
+
+
+def decode_payload(token: str) -> Dict[str, Any]:
+    """Decode the payload of a single token (raises on malformed input)."""
+    return loads(decode_segment(payload_segment(token)))
+
+
+def extract(payload: Any, path: Union[str, Sequence[str]], default: Any = None) -> Any:
+    """Read a dotted path such as 'service.id' from a decoded payload."""
+    keys = path.split('.') if isinstance(path, str) else path
+    value = payload
+    for key in keys:
+        if not isinstance(value, dict):
+            return default
+        value = value.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+    return value
+
+
+def decode_payloads(tokens: Iterable[str], fields: Optional[List[str]] = None) -> Iterator[Optional[Dict[str, Any]]]:
+    """Decode tokens lazily: the payload, only the requested dotted `fields`, or None for a malformed token."""
+    paths = [(field, field.split('.')) for field in fields] if fields else None
+    for token in tokens:
+        try:
+            payload = decode_payload(token)
+        except (ValueError, TypeError, AttributeError, binascii.Error):
+            # orjson.JSONDecodeError and json.JSONDecodeError are both ValueError subclasses
+            yield None
+            continue
+        if paths is None:
+            yield payload
+        else:
+            yield {field: extract(payload, keys) for field, keys in paths}
@@ -0,0 +1,56 @@
+"""Checkout token minting (same format as packages/tokens/src/create-token.ts)."""
+import base64
+import hashlib
+import hmac
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+HEADER = {"alg": "HS256", "typ": "JWT"}
+
+# The checkout page only reads service.id from the token and loads the service itself;
+# the other fields are kept for readability when inspecting a token
+SERVICE_TOKEN_FIELDS = ('id', 'name', 'price', 'currency', 'price_id', 'propietary_organization_id')
+
+
+def serialize(payload: Dict[str, Any]) -> bytes:
+    return json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def slim_service(service: Dict[str, Any], fields: Sequence[str] = SERVICE_TOKEN_FIELDS) -> Dict[str, Any]:
+    return {field: service[field] for field in fields if field in service}
+
+
+class CheckoutTokenMinter:
+    def __init__(self, secret: str):
+        self.secret = secret
+        self._encoded_header = base64.b64encode(serialize(HEADER))
+        self._mac = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+    def mint(self, payload: Dict[str, Any]) -> str:
+        signing_input = self._encoded_header + b'.' + base64.b64encode(serialize(payload))
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return (signing_input + b'.' + base64.b64encode(mac.digest())).decode('ascii')
+
+    def mint_many(self, payloads: Iterable[Dict[str, Any]], processes: Optional[int] = None,
+                  chunksize: int = 256) -> List[str]:
+        """Mint a batch of tokens, optionally spread over a process pool."""
+        if not processes or processes <= 1:
+            return [self.mint(payload) for payload in payloads]
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(self.secret,)) as pool:
+            return list(pool.map(_mint_in_worker, payloads, chunksize=chunksize))
+
+
+_worker_minter: Optional[CheckoutTokenMinter] = None
+
+
+def _init_worker(secret: str):
+    global _worker_minter
+    _worker_minter = CheckoutTokenMinter(secret)
+
+
+def _mint_in_worker(payload: Dict[str, Any]) -> str:
+    return _worker_minter.mint(payload)
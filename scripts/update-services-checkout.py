@@ -1,13 +1,21 @@
 import os
-from supabase import create_client, Client
-import json
+import argparse
+from supabase import Client
 from datetime import datetime, timedelta
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 import uuid
 import base64
-import hmac
-import hashlib
+import time
+
+import instrumentation
+from async_io import execute, run_io, write_with_row_fallback
+from clients import supabase_client
+from pg_backend import BACKENDS, PostgresWriter
+from sql_emitter import SqlEmitter
+from async_cache import AsyncCache
+from supabase_paging import iter_pages
+from token_minting import CheckoutTokenMinter, slim_service
 
 # Colores para la consola
 GREEN = "\033[92m"
@@ -18,16 +26,24 @@ RESET = "\033[0m"
 SUPABASE_URL = "your_supabase_url"
 SUPABASE_SERVICE_ROLE_KEY = "your_supabase_service_role_key"
 IS_PROD = False
+JWT_SECRET = 'your_jwt_secret'
+
+# Filas de tokens por insert y servicios por cada UPDATE ... FROM (VALUES ...)
+TOKEN_BATCH_SIZE = 500
+SQL_BATCH_SIZE = 500
+SQL_FILE = "update_checkout_urls.sql"
+# "values" (UPDATE ... FROM (VALUES ...)) o "copy" (COPY a una tabla temporal, para psql -f)
+SQL_FORMAT = "values"
 
 # Inicializar cliente de Supabase
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+supabase: Client = supabase_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
 async def get_organization(primary_owner_id: str) -> Dict:
     try:
         # Obtener organization_id del usuario
-        user_account = supabase.table('accounts').select(
+        user_account = await execute(supabase.table('accounts').select(
             'organization_id'
-        ).eq('id', primary_owner_id).single().execute()
+        ).eq('id', primary_owner_id).single())
 
         if not user_account.data or not user_account.data.get('organization_id'):
             raise ValueError(f"No organization found for user {primary_owner_id}")
@@ -35,9 +51,9 @@ async def get_organization(primary_owner_id: str) -> Dict:
         organization_id = user_account.data['organization_id']
 
         # Obtener datos de la organización
-        organization = supabase.table('accounts').select(
+        organization = await execute(supabase.table('accounts').select(
             'id, name, primary_owner_user_id, slug, email, picture_url, loom_app_id'
-        ).eq('id', organization_id).single().execute()
+        ).eq('id', organization_id).single())
 
         if not organization.data:
             raise ValueError(f"No organization data found for id {organization_id}")
@@ -50,9 +66,9 @@ async def get_organization(primary_owner_id: str) -> Dict:
 
 async def get_domain_by_organization_id(organization_id: str) -> str:
     try:
-        response = supabase.table('organization_subdomains').select(
+        response = await execute(supabase.table('organization_subdomains').select(
             'subdomains(domain)'
-        ).eq('organization_id', organization_id).limit(1).execute()
+        ).eq('organization_id', organization_id).limit(1))
 
         if response.data and len(response.data) > 0:
             subdomains = response.data[0].get('subdomains')
@@ -70,61 +86,121 @@ async def get_domain_by_organization_id(organization_id: str) -> str:
         print(f"{RED}Error getting domain for organization {organization_id}: {str(e)}{RESET}")
         return os.getenv('NEXT_PUBLIC_SITE_URL', 'http://localhost:3000/')
 
-async def generate_checkout_url(service: Dict[str, Any]) -> str:
+async def resolve_owner(owner_id: str) -> Dict[str, Any]:
+    # Obtener organización
+    organization = await get_organization(owner_id)
+
+    # Obtener stripe_id
+    stripe_account = await execute(supabase.table('billing_accounts').select('*').eq('account_id', owner_id))
+    stripe_id = stripe_account.data[0].get('stripe_id') if stripe_account.data else None
+
+    # Obtener base_url de la organización
+    base_url = await get_domain_by_organization_id(organization['id'])
+
+    return {
+        "organization": organization,
+        "stripe_id": stripe_id,
+        "base_url": base_url
+    }
+
+token_minter = CheckoutTokenMinter(JWT_SECRET)
+
+# Cache por ejecución: cada organización se resuelve una sola vez aunque tenga muchos servicios
+owner_cache = AsyncCache(resolve_owner)
+
+class TokenBatchInserter:
+    """Acumula filas de tokens y las inserta por lotes; solo los tokens guardados pasan a la cola del SQL."""
+
+    def __init__(self, sql_queue: Optional[asyncio.Queue], batch_size: int = TOKEN_BATCH_SIZE,
+                 pg_writer: Optional[PostgresWriter] = None):
+        self.sql_queue = sql_queue
+        self.batch_size = batch_size
+        self.pg_writer = pg_writer
+        self.pending: List[Tuple[Dict[str, Any], Any, str]] = []
+        self.inserted = 0
+        self.failed = 0
+
+    async def add(self, token_data: Dict[str, Any], service_id: Any, checkout_url: str):
+        self.pending.append((token_data, service_id, checkout_url))
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        batch, self.pending = self.pending, []
+        if batch:
+            await self._insert(batch)
+
+    async def _insert(self, batch: List[Tuple[Dict[str, Any], Any, str]]):
+        async def write(entries: List[Tuple[Dict[str, Any], Any, str]]):
+            if self.pg_writer is not None:
+                await run_io(self.pg_writer.apply, 'COPY tokens + UPDATE services',
+                             lambda session: self._apply(session, entries))
+            else:
+                await execute(supabase.table('tokens').insert([token_data for token_data, _, _ in entries]))
+
+        inserted = await write_with_row_fallback(write, batch, self._report_failure)
+        self.inserted += len(inserted)
+        if self.sql_queue is None:
+            return
+        for _, service_id, checkout_url in inserted:
+            await self.sql_queue.put((service_id, checkout_url))
+
+    def _report_failure(self, entry: Tuple[Dict[str, Any], Any, str], error: Exception):
+        self.failed += 1
+        print(f"{RED}Error inserting token for service {entry[1]}: {str(error)}{RESET}")
+
+    @staticmethod
+    def _apply(session, batch: List[Tuple[Dict[str, Any], Any, str]]):
+        session.insert('tokens', [token_data for token_data, _, _ in batch])
+        session.update('services', [{'id': int(service_id), 'checkout_url': checkout_url}
+                                    for _, service_id, checkout_url in batch], 'id')
+
+async def write_sql_updates(sql_queue: asyncio.Queue, sql_file: str, batch_size: int = SQL_BATCH_SIZE,
+                            sql_format: str = SQL_FORMAT) -> int:
+    """Único escritor del archivo SQL: agrupa las URLs en un UPDATE multi-fila por lote (o un bloque COPY)."""
+    with open(sql_file, "w", encoding="utf-8") as f:
+        f.write("-- Generated SQL updates for checkout URLs\n")
+        with SqlEmitter(f, 'services', ['id', 'checkout_url'], fmt=sql_format, operation='update', key='id',
+                        rows_per_statement=batch_size) as emitter:
+            while True:
+                item = await sql_queue.get()
+                if item is None:
+                    break
+                service_id, url = item
+                emitter.add((int(service_id), url))
+
+    return emitter.rows_written
+
+async def generate_checkout_url(service: Dict[str, Any], token_inserter: TokenBatchInserter) -> str:
     try:
         owner_id = service.get('propietary_organization_id')
         if not owner_id:
             raise ValueError(f"No owner_id found for service {service.get('id')}")
 
-        # Obtener organización
-        organization = await get_organization(owner_id)
-        
-        # Obtener stripe_id
-        stripe_account = supabase.table('billing_accounts').select('*').eq('account_id', owner_id).execute()
-        stripe_id = stripe_account.data[0].get('stripe_id') if stripe_account.data else None
-
-        # Obtener base_url para este servicio específico
-        base_url = await get_domain_by_organization_id(organization['id'])
+        owner = await owner_cache.get(owner_id)
+        organization = owner['organization']
+        stripe_id = owner['stripe_id']
+        base_url = owner['base_url']
 
-        # Generar token siguiendo la lógica de TypeScript
-        header = {
-            "alg": "HS256",
-            "typ": "JWT"
-        }
-        
         now = datetime.now()
         expires_at = now + timedelta(hours=1)  # 1 hour expiration
 
         token_payload = {
             "account_id": stripe_id or "",
             "price_id": "",
-            "service": service,
+            "service": slim_service(service),
             "expires_at": expires_at.isoformat(),
             "organization_id": organization['id'],
             "payment_methods": [],
             "primary_owner_id": owner_id
         }
 
-        # Generar tokens siguiendo la lógica de TypeScript
-        base64_header = base64.b64encode(json.dumps(header).encode()).decode()
-        base64_payload = base64.b64encode(json.dumps(token_payload).encode()).decode()
-        
-        # Generar firma
-        jwt_secret = 'your_jwt_secret'
-            
-        signature = base64.b64encode(
-            hmac.new(
-                jwt_secret.encode(),
-                f"{base64_header}.{base64_payload}".encode(),
-                hashlib.sha256
-            ).digest()
-        ).decode()
-
-        access_token = f"{base64_header}.{base64_payload}.{signature}"
+        # Generar token siguiendo la lógica de TypeScript (cabecera y HMAC precalculados)
+        access_token = token_minter.mint(token_payload)
         refresh_token = base64.b64encode(f"{str(uuid.uuid4())}suuper".encode()).decode()
         id_token_provider = f"{str(uuid.uuid4())}suuper"
 
-        # Insertar token
+        # Encolar el token para el insert por lotes
         token_data = {
             "access_token": access_token,
             "created_at": now.isoformat(),
@@ -135,51 +211,82 @@ async def generate_checkout_url(service: Dict[str, Any]) -> str:
             "updated_at": now.isoformat()
         }
 
-        token_response = supabase.table('tokens').insert(token_data).execute()
+        checkout_url = f"{base_url}checkout?tokenId={id_token_provider}"
+        await token_inserter.add(token_data, service['id'], checkout_url)
 
-        return f"{base_url}checkout?tokenId={id_token_provider}"
+        return checkout_url
 
     except Exception as e:
         print(f"{RED}Error generating checkout URL for service {service.get('id')}: {str(e)}{RESET}")
         return ""
 
-async def process_service(service: Dict[str, Any], sql_file: str):
+async def process_service(service: Dict[str, Any], token_inserter: TokenBatchInserter):
     try:
-        checkout_url = await generate_checkout_url(service)
+        checkout_url = await generate_checkout_url(service, token_inserter)
         if checkout_url:
-            sql_update = f"UPDATE services SET checkout_url = '{checkout_url}' WHERE id = '{service['id']}';\n"
-            # Escribir la actualización SQL en tiempo real
-            with open(sql_file, "a") as f:
-                f.write(sql_update)
             print(f"{GREEN}Generated checkout URL for service {service['id']}{RESET}")
     except Exception as e:
         print(f"{RED}Error processing service {service['id']}: {str(e)}{RESET}")
 
-async def main():
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generar checkout_url para los servicios que no la tienen")
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default='postgrest',
+        help=f"postgrest: tokens vía PostgREST y URLs a {SQL_FILE}; "
+             "postgres: tokens y URLs directo en la base de datos (DATABASE_URL)"
+    )
+    return parser.parse_args()
+
+async def main(args: argparse.Namespace):
+    started_at = time.perf_counter()
+    instrumentation.enable()
+    pg_writer = PostgresWriter() if args.backend == 'postgres' else None
     try:
-        # Obtener todos los servicios sin checkout_url
-        response = supabase.table('services').select('*').is_('checkout_url', 'null').execute()
-        services = response.data
-
-        if not services:
+        if pg_writer is None:
+            # Un único escritor consume la cola y genera el archivo SQL
+            sql_queue: Optional[asyncio.Queue] = asyncio.Queue()
+            writer_task = asyncio.create_task(write_sql_updates(sql_queue, SQL_FILE))
+        else:
+            sql_queue = None
+        token_inserter = TokenBatchInserter(sql_queue, pg_writer=pg_writer)
+        total_services = 0
+
+        try:
+            # Recorrer los servicios sin checkout_url página a página (keyset por id)
+            pages = iter_pages(lambda: supabase.table('services').select('*').is_('checkout_url', 'null'))
+            async for services in pages:
+                total_services += len(services)
+                print(f"Found {len(services)} services without checkout_url ({total_services} so far)")
+
+                # Procesar los servicios de la página concurrentemente
+                tasks = [process_service(service, token_inserter) for service in services]
+                await asyncio.gather(*tasks)
+            await token_inserter.flush()
+        finally:
+            if sql_queue is not None:
+                await sql_queue.put(None)
+                written = await writer_task
+
+        if not total_services:
             print(f"{GREEN}No services found without checkout_url{RESET}")
             return
 
-        print(f"Found {len(services)} services without checkout_url")
-
-        # Crear o limpiar el archivo SQL
-        sql_file = "update_checkout_urls.sql"
-        with open(sql_file, "w") as f:
-            f.write("-- Generated SQL updates for checkout URLs\n")
-
-        # Procesar servicios concurrentemente
-        tasks = [process_service(service, sql_file) for service in services]
-        await asyncio.gather(*tasks)
-
-        print(f"{GREEN}Completed processing all services{RESET}")
+        print(f"{GREEN}Completed processing all {total_services} services{RESET}")
+        print(f"Tokens inserted: {token_inserter.inserted}, failed: {token_inserter.failed}")
+        if pg_writer is None:
+            print(f"{GREEN}{written} checkout URL updates written to {SQL_FILE}{RESET}")
+        else:
+            print(f"{GREEN}{token_inserter.inserted} checkout URLs updated in the database{RESET}")
+        print(f"Organization cache: {owner_cache.summary()}")
+        instrumentation.print_summary(time.perf_counter() - started_at)
 
     except Exception as e:
         print(f"{RED}Error: {str(e)}{RESET}")
+    finally:
+        if pg_writer is not None:
+            pg_writer.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(parse_args()))
\ No newline at end of file
@@ -1,13 +1,20 @@
 import os
-from supabase import create_client, Client
-import json
+import argparse
+from supabase import Client
 from datetime import datetime
 import asyncio
+import time
 from typing import Dict, Any, List, Optional
-import base64
 import logging
 from urllib.parse import urlparse, parse_qs
 
+import instrumentation
+from async_io import chunked, execute, run_io, write_with_row_fallback
+from clients import supabase_client
+from pg_backend import BACKENDS, PostgresWriter
+from supabase_paging import iter_pages
+from token_codec import decode_payload, decode_payloads
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -28,16 +35,20 @@ RESET = "\033[0m"
 SUPABASE_URL = "your_supabase_url"
 SUPABASE_SERVICE_ROLE_KEY = "your_supabase_service_role_key"
 
+# Tokens read per keyset page and processed concurrently per batch
+PAGE_SIZE = 1000
+BATCH_SIZE = 50
+# Set-based mode: ids per in_() lookup and rows per upsert
+IN_CHUNK_SIZE = 100
+UPSERT_BATCH_SIZE = 500
+
 # Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+supabase: Client = supabase_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
 def decode_token(token: str) -> Optional[Dict]:
     try:
-        # Split the token and get the payload part
-        base64_payload = token.split('.')[1]
-        # Decode the payload
-        payload = json.loads(base64.b64decode(base64_payload + '=' * (-len(base64_payload) % 4)).decode('utf-8'))
-        return payload
+        # Decode only the payload part (base64 or base64url, padding fixed by the codec)
+        return decode_payload(token)
     except Exception as e:
         logging.error(f"Error decoding token: {str(e)}")
         return None
@@ -63,9 +74,9 @@ async def process_single_token(token: Dict) -> tuple[int, int]:
         service_id = decoded_payload['service']['id']
 
         # Get service checkout_url
-        service_response = supabase.table('services').select(
+        service_response = await execute(supabase.table('services').select(
             'checkout_url'
-        ).eq('id', service_id).single().execute()
+        ).eq('id', service_id).single())
 
         if not service_response.data or not service_response.data.get('checkout_url'):
             logging.warning(f"No checkout_url found for service {service_id}")
@@ -78,18 +89,18 @@ async def process_single_token(token: Dict) -> tuple[int, int]:
             return 0, 1
 
         # Get new access_token using token_id
-        new_token_response = supabase.table('tokens').select(
+        new_token_response = await execute(supabase.table('tokens').select(
             'access_token'
-        ).eq('id_token_provider', token_id).single().execute()
+        ).eq('id_token_provider', token_id).single())
 
         if not new_token_response.data:
             logging.warning(f"No token found with id_token_provider {token_id}")
             return 0, 1
 
         # Update the original token with new access_token
-        update_response = supabase.table('tokens').update({
+        update_response = await execute(supabase.table('tokens').update({
             'access_token': new_token_response.data['access_token']
-        }).eq('id', token['id']).execute()
+        }).eq('id', token['id']))
 
         if update_response.data:
             logging.info(f"{GREEN}Successfully updated token {token['id']}{RESET}")
@@ -112,42 +123,166 @@ async def process_token_batch(tokens: List[Dict]) -> tuple[int, int]:
     
     return updated_count, failed_count
 
-async def main():
+class SetBasedTokenUpdater:
+    """Resolve and update a whole page of tokens with a handful of bulk queries."""
+
+    def __init__(self, pg_writer: Optional[PostgresWriter] = None):
+        self.pg_writer = pg_writer
+        self.checkout_token_ids: Dict[str, Optional[str]] = {}
+        self.access_tokens: Dict[str, Optional[str]] = {}
+
+    async def process_page(self, tokens: List[Dict]) -> tuple[int, int]:
+        failed = 0
+        service_ids: Dict[str, str] = {}
+
+        decoded = decode_payloads((token['access_token'] for token in tokens), fields=['service.id'])
+        for token, fields in zip(tokens, decoded):
+            if not fields or fields['service.id'] is None:
+                logging.warning(f"Token {token['id']} has no service.id in payload")
+                failed += 1
+                continue
+            service_ids[token['id']] = str(fields['service.id'])
+
+        await self._resolve_services(set(service_ids.values()))
+        await self._resolve_access_tokens(
+            {token_id for token_id in self.checkout_token_ids.values() if token_id}
+        )
+
+        updates = []
+        for token_id, service_id in service_ids.items():
+            checkout_token_id = self.checkout_token_ids.get(service_id)
+            if not checkout_token_id:
+                logging.warning(f"No checkout_url tokenId found for service {service_id}")
+                failed += 1
+                continue
+            new_access_token = self.access_tokens.get(checkout_token_id)
+            if not new_access_token:
+                logging.warning(f"No token found with id_token_provider {checkout_token_id}")
+                failed += 1
+                continue
+            updates.append({'id': token_id, 'access_token': new_access_token})
+
+        updated = 0
+        for batch in chunked(updates, UPSERT_BATCH_SIZE):
+            batch_updated, batch_failed = await self._write(batch)
+            updated += batch_updated
+            failed += batch_failed
+
+        return updated, failed
+
+    async def _resolve_services(self, service_ids: set):
+        missing = [service_id for service_id in service_ids if service_id not in self.checkout_token_ids]
+        responses = await asyncio.gather(*[
+            execute(supabase.table('services').select('id, checkout_url').in_('id', chunk))
+            for chunk in chunked(missing, IN_CHUNK_SIZE)
+        ])
+        for service_id in missing:
+            self.checkout_token_ids[service_id] = None
+        for response in responses:
+            for service in response.data or []:
+                if service.get('checkout_url'):
+                    self.checkout_token_ids[str(service['id'])] = extract_token_id(service['checkout_url'])
+
+    async def _resolve_access_tokens(self, token_ids: set):
+        missing = [token_id for token_id in token_ids if token_id not in self.access_tokens]
+        responses = await asyncio.gather(*[
+            execute(supabase.table('tokens').select('id_token_provider, access_token').in_('id_token_provider', chunk))
+            for chunk in chunked(missing, IN_CHUNK_SIZE)
+        ])
+        for token_id in missing:
+            self.access_tokens[token_id] = None
+        for response in responses:
+            for token in response.data or []:
+                self.access_tokens[token['id_token_provider']] = token['access_token']
+
+    async def _write(self, rows: List[Dict[str, Any]]) -> tuple[int, int]:
+        not_found = 0
+
+        async def write(batch: List[Dict[str, Any]]):
+            nonlocal not_found
+            if self.pg_writer is not None:
+                not_found += len(batch) - await run_io(self.pg_writer.update, 'tokens', batch, 'id')
+                return
+            # missing=default keeps the untouched columns of the existing rows valid for the upsert
+            await execute(supabase.table('tokens').upsert(batch, on_conflict='id', default_to_null=False))
+
+        def report_failure(row: Dict[str, Any], error: Exception):
+            logging.error(f"{RED}Failed to update token {row['id']}: {str(error)}{RESET}")
+
+        written = await write_with_row_fallback(write, rows, report_failure)
+        return len(written) - not_found, len(rows) - len(written) + not_found
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replace legacy checkout access tokens with the current service token")
+    parser.add_argument(
+        '--set-based',
+        action='store_true',
+        help="Resolve services and replacement tokens in bulk per page instead of 3 queries per token"
+    )
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default='postgrest',
+        help="Write the set-based updates through PostgREST or straight to Postgres (DATABASE_URL)"
+    )
+    args = parser.parse_args()
+    if args.backend == 'postgres' and not args.set_based:
+        parser.error("--backend postgres is only available with --set-based")
+    return args
+
+async def main(args: argparse.Namespace):
+    started_at = time.perf_counter()
+    instrumentation.enable()
     try:
         target_date = "2025-02-26 18:19:33.55659+00"
         
-        # Get all tokens with provider 'suuper' created before target date
-        response = supabase.table('tokens').select(
+        total_tokens = 0
+        total_updated = 0
+        total_failed = 0
+
+        # Stream tokens with provider 'suuper' created before target date, page by page
+        pages = iter_pages(lambda: supabase.table('tokens').select(
             'id, access_token'
-        ).eq('provider', 'suuper').lt('created_at', target_date).execute()
+        ).eq('provider', 'suuper').lt('created_at', target_date), page_size=PAGE_SIZE)
 
-        if not response.data:
-            logging.info("No tokens found to process")
-            return
+        pg_writer = PostgresWriter() if args.backend == 'postgres' else None
+        set_based_updater = SetBasedTokenUpdater(pg_writer) if args.set_based else None
 
-        total_tokens = len(response.data)
-        logging.info(f"Found {total_tokens} tokens to process")
+        try:
+            async for page in pages:
+                if set_based_updater:
+                    updated, failed = await set_based_updater.process_page(page)
+                    total_updated += updated
+                    total_failed += failed
+                    total_tokens += len(page)
+                    logging.info(f"Progress: {total_tokens} tokens processed")
+                    continue
 
-        # Process tokens in batches of 50 for better performance
-        batch_size = 50
-        total_updated = 0
-        total_failed = 0
+                # Process each page in batches for better performance
+                for i in range(0, len(page), BATCH_SIZE):
+                    batch = page[i:i + BATCH_SIZE]
+                    updated, failed = await process_token_batch(batch)
+                    total_updated += updated
+                    total_failed += failed
+                    total_tokens += len(batch)
 
-        for i in range(0, total_tokens, batch_size):
-            batch = response.data[i:i + batch_size]
-            updated, failed = await process_token_batch(batch)
-            total_updated += updated
-            total_failed += failed
-            
-            logging.info(f"Progress: {i + len(batch)}/{total_tokens} tokens processed")
+                    logging.info(f"Progress: {total_tokens} tokens processed")
+        finally:
+            if pg_writer is not None:
+                pg_writer.close()
+
+        if not total_tokens:
+            logging.info("No tokens found to process")
+            return
 
         logging.info(f"{GREEN}Processing completed:{RESET}")
         logging.info(f"Total tokens processed: {total_tokens}")
         logging.info(f"{GREEN}Successfully updated: {total_updated}{RESET}")
         logging.info(f"{RED}Failed to update: {total_failed}{RESET}")
+        instrumentation.print_summary(time.perf_counter() - started_at)
 
     except Exception as e:
         logging.error(f"{RED}Critical error: {str(e)}{RESET}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(parse_args()))
\ No newline at end of file